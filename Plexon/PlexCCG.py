@@ -0,0 +1,153 @@
+#!/usr/bin/python
+#coding:utf-8
+
+###########################################################
+### Cross-correlograms of spike trains
+###########################################################
+
+from __future__ import division
+import os
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+import logging
+logger = logging.getLogger('SpikeRecord.Plexon')
+from PlexPeriEvent import get_train_arrays
+
+# pairs per task of the process pool
+CCG_CHUNK_PAIRS = 64
+# spikes of the first train of a pair per gather
+CCG_CHUNK_SPIKES = 65536
+
+def get_lag_edges(max_lag, bin_size):
+    """
+    Return lag bin edges symmetric about 0, with 0 an edge, extending outward
+    to the first multiple of bin_size at or beyond max_lag.
+    """
+    if max_lag <= 0 or bin_size <= 0:
+        raise ValueError("max_lag and bin_size must be positive.")
+    half_bins = int(np.ceil(max_lag / bin_size - 1e-9))
+    return bin_size * np.arange(-half_bins, half_bins + 1)
+
+def count_lags(train_a, train_b, edges):
+    """
+    Return the number of spikes of train_b at lags [edges[0], edges[-1]) from the
+    spikes of train_a, binned by edges. The window of train_b around every spike of
+    train_a is found with searchsorted over the sorted trains, so only the spike
+    pairs within the lag window are visited instead of all pairwise differences.
+    """
+    count = np.zeros(len(edges) - 1, dtype=np.int64)
+    for first in xrange(0, len(train_a), CCG_CHUNK_SPIKES):
+        spikes = train_a[first:first+CCG_CHUNK_SPIKES]
+        lo = np.searchsorted(train_b, spikes + edges[0])
+        hi = np.searchsorted(train_b, spikes + edges[-1])
+        counts = hi - lo
+        offsets = np.cumsum(counts) - counts
+        positions = np.repeat(lo - offsets, counts) + np.arange(counts.sum())
+        lags = train_b[positions] - np.repeat(spikes, counts)
+        bins = np.searchsorted(edges, lags, side='right') - 1
+        count += np.bincount(bins.clip(0, len(count) - 1), minlength=len(count))
+    return count
+
+def GetCrossCorrelogram(train_a, train_b, max_lag, bin_size):
+    """
+    GetCrossCorrelogram(train_a, train_b, max_lag, bin_size) -> (edges, count)
+
+    Parameters
+    ----------
+    train_a, train_b: array
+        spike times in time order
+    max_lag: float
+        lags in [-max_lag, max_lag) of train_b spikes relative to train_a spikes are counted;
+        a max_lag that is not a multiple of bin_size is rounded up to the next one, so that
+        the bins stay symmetric about a bin edge at lag 0
+    bin_size: float
+        lag bin width, in the unit of the spike times
+
+    Returns
+    -------
+    edges: lag bin edges
+    count: number of spike pairs in every lag bin
+    """
+    edges = get_lag_edges(max_lag, bin_size)
+    train_a = np.asarray(train_a, dtype=np.float64)
+    train_b = np.asarray(train_b, dtype=np.float64)
+    return edges, count_lags(train_a, train_b, edges)
+
+# spike trains of the process pool workers, memory mapped read-only
+_shared_trains = None
+
+def init_ccg_worker(timestamp_filename, offsets_filename):
+    global _shared_trains
+    _shared_trains = (np.load(timestamp_filename, mmap_mode='r'), np.load(offsets_filename, mmap_mode='r'))
+
+def ccg_pairs(args):
+    """
+    Process pool worker: count the lags of a chunk of unit pairs of the
+    memory mapped trains. Returns a (pairs, bins) array.
+    """
+    pairs, edges = args
+    timestamp, offsets = _shared_trains
+    count = np.empty((len(pairs), len(edges) - 1), dtype=np.int64)
+    for i, (a, b) in enumerate(pairs):
+        count[i] = count_lags(timestamp[offsets[a]:offsets[a+1]], timestamp[offsets[b]:offsets[b+1]], edges)
+    return count
+
+def GetCrossCorrelograms(trains, max_lag, bin_size, pairs=None, processes=1):
+    """
+    GetCrossCorrelograms(trains, max_lag, bin_size, pairs, processes) -> ccgs
+
+    Parameters
+    ----------
+    trains: dict or list
+        the groups of PlexUtil.GetSpikeTrainGroups or a list of spike time arrays in time order
+    max_lag, bin_size: float
+        as in GetCrossCorrelogram
+    pairs: array
+        (n, 2) train indices of the pairs, all pairs i < j by default
+    processes: int
+        number of worker processes. The trains are written once to memory mapped .npy
+        files that the workers open read-only, instead of pickling them to every task.
+
+    Returns
+    -------
+    ccgs: dict
+        'pairs': (n, 2) train indices of the pairs
+        'edges': lag bin edges
+        'count': (n, bins) number of spike pairs in every lag bin
+    """
+    global _shared_trains
+    timestamp, offsets = get_train_arrays(trains)
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+    units = len(offsets) - 1
+    if pairs is None:
+        first, second = np.triu_indices(units, 1)
+        pairs = np.column_stack((first, second))
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    edges = get_lag_edges(max_lag, bin_size)
+    chunks = [(pairs[i:i+CCG_CHUNK_PAIRS], edges) for i in xrange(0, len(pairs), CCG_CHUNK_PAIRS)]
+
+    if processes <= 1 or len(chunks) <= 1:
+        _shared_trains = (timestamp, offsets)
+        try:
+            counts = [ccg_pairs(chunk) for chunk in chunks]
+        finally:
+            _shared_trains = None
+    else:
+        dirname = tempfile.mkdtemp(prefix='plexccg')
+        try:
+            timestamp_filename = os.path.join(dirname, 'timestamp.npy')
+            offsets_filename = os.path.join(dirname, 'offsets.npy')
+            np.save(timestamp_filename, timestamp)
+            np.save(offsets_filename, offsets)
+            pool = multiprocessing.Pool(processes, init_ccg_worker, (timestamp_filename, offsets_filename))
+            try:
+                counts = pool.map(ccg_pairs, chunks)
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            shutil.rmtree(dirname, ignore_errors=True)
+    count = np.concatenate(counts) if counts else np.empty((0, len(edges) - 1), dtype=np.int64)
+    return {'pairs': pairs, 'edges': edges, 'count': count}
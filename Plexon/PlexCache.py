@@ -0,0 +1,228 @@
+#!/usr/bin/python
+#coding:utf-8
+
+###########################################################
+### Columnar .npy cache of Plexon plx files
+###########################################################
+
+from __future__ import division
+import os
+import sys
+import json
+import numpy as np
+import logging
+logger = logging.getLogger('SpikeRecord.Plexon')
+from PlexFile import PlexFile, PL_SingleWFType, PL_ExtEventType, PAYLOAD_CHUNK_BLOCKS
+
+CACHE_VERSION = 2
+CACHE_SUFFIX = '.cache'
+MANIFEST_NAME = 'manifest.json'
+
+# column file names of the cache directory
+TIMESTAMP_COLUMNS = ('type', 'channel', 'unit', 'tick', 'timestamp')
+AD_COLUMNS = ('channel', 'value', 'timestamp')
+
+def get_cache_dirname(filename):
+    return filename + CACHE_SUFFIX
+
+def ConvertPlexFile(filename, dirname=None, callback=None):
+    """
+    ConvertPlexFile(filename, dirname, callback) -> dirname
+
+    Parameters
+    ----------
+    filename: str
+        .plx file to convert.
+    dirname: str
+        Cache directory, filename + '.cache' by default.
+    callback(percentage,done_size,file_size,elapsed_time,left_time)
+        Callback method reports file reading progress.
+
+    Write spikes, events, continuous channels and waveforms of a .plx file to a directory of
+    memory-mappable .npy columns described by manifest.json. The manifest is written last so
+    that an interrupted conversion is never taken for a complete cache.
+    """
+    if dirname is None:
+        dirname = get_cache_dirname(filename)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    manifest_filename = os.path.join(dirname, MANIFEST_NAME)
+    if os.path.exists(manifest_filename):
+        os.remove(manifest_filename)
+
+    pf = PlexFile(filename)
+    pf.read_data_header()
+    columns = {}
+    def save(name, array):
+        np.save(os.path.join(dirname, name + '.npy'), array)
+        columns[name] = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+    data = pf.GetTimeStampArrays(callback, ticks=True)
+    data['tick'] = data.pop('timestamp')
+    data['timestamp'] = (data['tick'] / pf.file_header.ADFrequency).astype(np.float32)
+    for name in TIMESTAMP_COLUMNS:
+        save(name, data[name])
+    del data
+
+    ad_data = pf.GetADDataArrays()
+    for name in AD_COLUMNS:
+        save('ad_' + name, ad_data[name])
+    del ad_data
+
+    # waveforms of all spike records, written in chunks to bound memory
+    index = pf.GetBlockIndex()
+    events = index[(index['type'] == PL_SingleWFType) | (index['type'] == PL_ExtEventType)]
+    # rows are as wide as the longest waveform, each record's length is kept in
+    # waveform_points since the blocks need not match the header NumPointsWave
+    records = np.flatnonzero((events['type'] == PL_SingleWFType) & (events['nwaves'] > 0))
+    points = events['nwaves'][records].astype(np.int64) * events['nwords'][records]
+    waveforms = np.lib.format.open_memmap(os.path.join(dirname, 'waveform.npy'), mode='w+',
+                                          dtype=np.int16, shape=(len(records), points.max() if len(points) else 0))
+    for first in xrange(0, len(records), PAYLOAD_CHUNK_BLOCKS):
+        chunk = records[first:first+PAYLOAD_CHUNK_BLOCKS]
+        chunk_points = points[first:first+PAYLOAD_CHUNK_BLOCKS]
+        for length in np.unique(chunk_points):
+            rows = np.flatnonzero(chunk_points == length)
+            waveforms[first + rows, :length] = pf.read_waveforms(events[chunk[rows]])
+    waveforms.flush()
+    columns['waveform'] = {'dtype': waveforms.dtype.str, 'shape': list(waveforms.shape)}
+    del waveforms
+    save('waveform_record', records)
+    save('waveform_points', points.astype(np.int32))
+
+    stat = os.stat(filename)
+    header = pf.file_header
+    manifest = {'version': CACHE_VERSION,
+                'source': os.path.abspath(filename),
+                'source_size': stat.st_size,
+                'source_mtime': stat.st_mtime,
+                'ADFrequency': header.ADFrequency,
+                'NumPointsWave': header.NumPointsWave,
+                'SpikeMaxMagnitudeMV': header.SpikeMaxMagnitudeMV,
+                'BitsPerSpikeSample': header.BitsPerSpikeSample,
+                'SpikePreAmpGain': header.SpikePreAmpGain,
+                'datetime': pf.get_datetime().isoformat(),
+                'dsp_gains': dict((str(h.Channel), h.Gain) for h in pf.chan_headers),
+                'slow_channels': dict((str(h.Channel), {'name': h.Name, 'ADFreq': h.ADFreq, 'Gain': h.Gain})
+                                      for h in pf.slow_headers),
+                'columns': columns}
+    with open(manifest_filename, 'w') as fp:
+        json.dump(manifest, fp, indent=1)
+    return dirname
+
+def is_cache_valid(filename, dirname=None):
+    """
+    Return whether the cache directory holds a complete conversion of the
+    current version of filename.
+    """
+    if dirname is None:
+        dirname = get_cache_dirname(filename)
+    manifest_filename = os.path.join(dirname, MANIFEST_NAME)
+    if not os.path.exists(manifest_filename):
+        return False
+    with open(manifest_filename) as fp:
+        manifest = json.load(fp)
+    stat = os.stat(filename)
+    return manifest['version'] == CACHE_VERSION and manifest['source_size'] == stat.st_size and \
+           manifest['source_mtime'] == stat.st_mtime
+
+def OpenPlexFile(filename, dirname=None, callback=None):
+    """
+    OpenPlexFile(filename, dirname, callback) -> PlexCacheFile
+
+    Return a reader of the cache of filename, converting the file first if
+    the cache is missing or out of date.
+    """
+    if dirname is None:
+        dirname = get_cache_dirname(filename)
+    if not is_cache_valid(filename, dirname):
+        logger.info("Converting %s to %s" %(filename, dirname))
+        ConvertPlexFile(filename, dirname, callback)
+    return PlexCacheFile(dirname)
+
+class PlexCacheFile(object):
+    """
+    Reading the .npy cache of a Plexon plx file
+
+    Offers the reading API of PlexFile. The columns are memory mapped, so
+    opening is cheap and the returned arrays are read-only views of the files.
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        with open(os.path.join(dirname, MANIFEST_NAME)) as fp:
+            self.manifest = json.load(fp)
+        if self.manifest['version'] != CACHE_VERSION:
+            raise RuntimeError("Cache version %d is not supported." %self.manifest['version'])
+        self.ad_frequency = self.manifest['ADFrequency']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def _load(self, name):
+        return np.load(os.path.join(self.dirname, name + '.npy'), mmap_mode='r')
+
+    def GetTimeStampArrays(self, callback=None, ticks=False):
+        """
+        GetTimeStampArrays(callback, ticks) -> {'type', 'channel', 'unit', 'timestamp'}
+
+        Same as PlexFile.GetTimeStampArrays. callback is accepted for compatibility and not called.
+        """
+        data = {}
+        for name in ('type', 'channel', 'unit'):
+            data[name] = self._load(name)
+        data['timestamp'] = self._load('tick' if ticks else 'timestamp')
+        return data
+
+    def TicksToSeconds(self, ticks):
+        return np.asarray(ticks) / self.ad_frequency
+
+    def GetNullTimeStamp(self):
+        data = {}
+        data['type'] = np.empty(0,dtype=np.uint16)
+        data['channel'] = np.empty(0,dtype=np.uint16)
+        data['unit'] = np.empty(0,dtype=np.uint16)
+        data['timestamp'] = np.empty(0)
+        return data
+
+    def GetADDataArrays(self, callback=None):
+        """
+        GetADDataArrays(callback) -> {'channel', 'value', 'timestamp'}
+
+        Same as PlexFile.GetADDataArrays. callback is accepted for compatibility and not called.
+        """
+        return dict((name, self._load('ad_' + name)) for name in AD_COLUMNS)
+
+    def GetWaveforms(self, channel, unit=None, scaled=False):
+        """
+        GetWaveforms(channel, unit, scaled) -> waveforms
+
+        Same as PlexFile.GetWaveforms.
+        """
+        records = self._load('waveform_record')
+        spikes = self._load('channel')[records] == channel
+        if unit is not None:
+            spikes &= self._load('unit')[records] == unit
+        points = np.unique(self._load('waveform_points')[spikes])
+        if len(points) == 0:
+            waveforms = np.empty((0, 0), dtype=np.int16)
+        elif len(points) > 1:
+            raise ValueError("Waveforms of different lengths %s cannot be stacked." %list(points))
+        else:
+            waveforms = self._load('waveform')[spikes][:, :points[0]]
+        if scaled:
+            manifest = self.manifest
+            scale = manifest['SpikeMaxMagnitudeMV'] / \
+                    (0.5 * 2**manifest['BitsPerSpikeSample'] * manifest['dsp_gains'][str(channel)] *
+                     manifest['SpikePreAmpGain'])
+            waveforms = (waveforms * scale).astype(np.float32)
+        return waveforms
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "usage: python PlexCache.py file.plx [file.plx ...]"
+        sys.exit(1)
+    for filename in sys.argv[1:]:
+        print "converting %s to %s" %(filename, ConvertPlexFile(filename))
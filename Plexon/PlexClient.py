@@ -7,13 +7,38 @@
 ###########################################################
 
 from __future__ import division
+import time
 import ctypes
+import threading
 import numpy as np
 import Plexon
 import logging
 logger = logging.getLogger('SpikeRecord.Plexon')
 
 MAX_MAP_EVENTS_PER_READ = 8000
+ACQUISITION_INTERVAL = 0.01
+ACQUISITION_CAPACITY = 2**20
+MAX_SLOW_CHANNELS = 256
+# input range of the slow channel a/d converter, +-5 V
+AD_FULL_SCALE_VOLTS = 5.0
+AD_BUFFER_DURATION = 10.0
+
+
+def get_structure_dtype(structure):
+    """
+    Return the numpy dtype with the field names, types and offsets of a ctypes
+    Structure, so that an array of the structures can be viewed as a structured array.
+    """
+    names = [name for name, _ctype in structure._fields_]
+    formats = [(np.dtype(ctype._type_), (ctype._length_,)) if issubclass(ctype, ctypes.Array) else np.dtype(ctype)
+               for _name, ctype in structure._fields_]
+    offsets = [getattr(structure, name).offset for name in names]
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                     'itemsize': ctypes.sizeof(structure)})
+
+PL_EVENT_DTYPE = get_structure_dtype(Plexon.PL_Event)
+PL_WAVE_DTYPE = get_structure_dtype(Plexon.PL_Wave)
+PL_WAVE_LONG_DTYPE = get_structure_dtype(Plexon.PL_WaveLong)
 
 
 class PlexClient(object):
@@ -37,12 +62,32 @@ class PlexClient(object):
             self.MAX_MAP_EVENTS_PER_READ, dtype=np.uint32)
         self.ServerEventBuffer = (
             Plexon.PL_Event * self.MAX_MAP_EVENTS_PER_READ)()
+        self.ServerWaveBuffer = (
+            Plexon.PL_Wave * self.MAX_MAP_EVENTS_PER_READ)()
+        self.ServerWaveLongBuffer = (
+            Plexon.PL_WaveLong * self.MAX_MAP_EVENTS_PER_READ)()
+        # structured array views sharing the memory of the ctypes buffers
+        self.ServerEvents = np.frombuffer(
+            self.ServerEventBuffer, dtype=PL_EVENT_DTYPE)
+        self.ServerWaves = np.frombuffer(
+            self.ServerWaveBuffer, dtype=PL_WAVE_DTYPE)
+        self.ServerWavesLong = np.frombuffer(
+            self.ServerWaveLongBuffer, dtype=PL_WAVE_LONG_DTYPE)
+        # waveforms dropped by the server and in the MMF transfer, see GetWaveFormStructures
+        self.ServerDropped = 0
+        self.MMFDropped = 0
+        # per slow channel ring buffers of AD streaming, see StartADStreaming
+        self.ADBuffers = None
+        # upper bits of the timestamps, counted from wraps of the 32-bit ones
+        self.reset_timestamp_unwrap()
+        self.Acquisition = None
 
     def __enter__(self):
         self.InitClient()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        self.StopAcquisition()
         self.CloseClient()
 
     def __getattr__(self, name):
@@ -57,6 +102,7 @@ class PlexClient(object):
 
         Initializes PlexClient.dll for a client. Opens MMF's and registers the client with the server. Remeber to close the client by yourself. Or try the 'with' statement to initialize the PlexClient class.
         """
+        self.reset_timestamp_unwrap()
         if not self.library:
             logger.warning('Failed to load Plexon client library.')
             return
@@ -75,6 +121,7 @@ class PlexClient(object):
         Sends ClientDisconnected command to the server.
         The server decrements the counter for the number of connected clients.
         """
+        self.reset_timestamp_unwrap()
         if not self.library:
             return
         Plexon.PL_CloseClient()
@@ -106,44 +153,101 @@ class PlexClient(object):
     def MarkEvent(self, channel):
         return Plexon.PL_SendUserEvent(channel)
 
-    def GetTimeStampArrays(self, num=MAX_MAP_EVENTS_PER_READ):
+    def TicksToSeconds(self, ticks):
+        """
+        TicksToSeconds(ticks) -> seconds
+
+        Convert int64 timestamp ticks as returned with ticks=True to float64 seconds.
+        """
+        return np.asarray(ticks) / self.MAPSampleRate
+
+    def reset_timestamp_unwrap(self):
+        """
+        Forget the timestamps seen so far, so that the next read of a new
+        server session starts from upper bits 0.
+        """
+        self.UpperTimestamp = 0
+        self.LastTimestamp = None
+
+    def UnwrapTimeStamps(self, timestamps):
+        """
+        UnwrapTimeStamps(timestamps) -> ticks
+
+        Extend 32-bit server timestamps to int64 ticks. The upper bits are
+        counted from the wraps of the timestamps seen so far in this session:
+        a backward jump of more than half the 32-bit range is taken as a wrap,
+        a forward one as a late timestamp from before the last wrap.
+        GetTimeStampArrays calls it on every read, so the state is only correct
+        if no other reads of the session bypass it. It is reset by InitClient and
+        CloseClient.
         """
-        GetTimeStampArrays(num) -> {'type', 'channel', 'unit', 'timestamp'}
+        ticks = timestamps.astype(np.int64)
+        if not len(ticks):
+            return ticks
+        if self.LastTimestamp is None:
+            self.LastTimestamp = ticks[0]
+        steps = np.diff(np.append(self.LastTimestamp, ticks))
+        upper = self.UpperTimestamp + \
+            np.cumsum((steps < -2**31).astype(np.int64) - (steps > 2**31))
+        self.LastTimestamp = ticks[-1]
+        self.UpperTimestamp = upper[-1]
+        ticks += upper << 32
+        return ticks
+
+    def read_timestamp_arrays(self, num):
+        """
+        Fill the event arrays with at most num recent timestamps from the server.
+        Return the number of timestamps read, or None without a client library.
+        """
+        if not self.library:
+            return None
+        num = ctypes.c_int(num)
+        Plexon.PL_GetTimeStampArrays(ctypes.byref(num),
+                                     self.EventTypeArray.ctypes.data_as(
+                                         ctypes.POINTER(ctypes.c_short)),
+                                     self.EventChannelArray.ctypes.data_as(
+                                         ctypes.POINTER(ctypes.c_short)),
+                                     self.EventUnitArray.ctypes.data_as(
+                                         ctypes.POINTER(ctypes.c_short)),
+                                     self.EventTimestampArray.ctypes.data_as(ctypes.POINTER(ctypes.c_int)))
+        return num.value
+
+    def GetTimeStampArrays(self, num=MAX_MAP_EVENTS_PER_READ, ticks=False):
+        """
+        GetTimeStampArrays(num, ticks) -> {'type', 'channel', 'unit', 'timestamp'}
 
         Return dictionary of recent timestamps.
         Parameters
         ----------
         num: number
             Interger of maximun number of timestamp structures
+        ticks: bool
+            Return 'timestamp' as int64 ticks instead of seconds. Use TicksToSeconds to
+            convert them. Both include the upper bits counted by UnwrapTimeStamps.
 
         Returns
         -------
         'type', 'channel', 'unit', 'timestamp': dict keys
             Values are four 1-D arrays of the timestamp structure fields. The array length is the actual transferred TimeStamps.
-            'timestamp' is converted to seconds.
+            'timestamp' is converted to seconds unless ticks is True.
         """
-        num = ctypes.c_int(num)
+        num = self.read_timestamp_arrays(num)
         data = {}
-        if self.library:
-            Plexon.PL_GetTimeStampArrays(ctypes.byref(num),
-                                         self.EventTypeArray.ctypes.data_as(
-                                             ctypes.POINTER(ctypes.c_short)),
-                                         self.EventChannelArray.ctypes.data_as(
-                                             ctypes.POINTER(ctypes.c_short)),
-                                         self.EventUnitArray.ctypes.data_as(
-                                             ctypes.POINTER(ctypes.c_short)),
-                                         self.EventTimestampArray.ctypes.data_as(ctypes.POINTER(ctypes.c_int)))
-            data['type'] = self.EventTypeArray[:num.value]
-            data['channel'] = self.EventChannelArray[:num.value]
-            data['unit'] = self.EventUnitArray[:num.value]
-            # make man readable timestamp
-            data['timestamp'] = self.EventTimestampArray[
-                :num.value] / self.MAPSampleRate
+        if num is not None:
+            data['type'] = self.EventTypeArray[:num]
+            data['channel'] = self.EventChannelArray[:num]
+            data['unit'] = self.EventUnitArray[:num]
+            # every read advances the wrap count, whatever the returned unit
+            data['timestamp'] = self.UnwrapTimeStamps(
+                self.EventTimestampArray[:num])
+            if not ticks:
+                # make man readable timestamp
+                data['timestamp'] = data['timestamp'] / self.MAPSampleRate
         else:
             data['type'] = np.empty(0, dtype=np.uint16)
             data['channel'] = np.empty(0, dtype=np.uint16)
             data['unit'] = np.empty(0, dtype=np.uint16)
-            data['timestamp'] = np.empty(0)
+            data['timestamp'] = np.empty(0, dtype=np.int64 if ticks else np.float64)
         return data
 
     def GetTimeStampStructures(self, num=MAX_MAP_EVENTS_PER_READ):
@@ -160,10 +264,353 @@ class PlexClient(object):
         -------
         num: number 
             Number of actual number of timestamp structures transferred
-        array: ctype array
-            Array of PL_Event structures filled with new data
+        array: structured ndarray
+            PL_EVENT_DTYPE view of the first num PL_Event structures of ServerEventBuffer,
+            so every field is a column, e.g. array['Channel']. The view is overwritten by the next read.
+        """
+        num = self.read_timestamp_structures(num)
+        return (num, self.ServerEvents[:num])
+
+    def GetWaveFormStructures(self, num=MAX_MAP_EVENTS_PER_READ, long_wave=None):
+        """
+        GetWaveFormStructures(num, long_wave) -> (num, array)
+
+        Get recent waveform number and structures.
+        Parameters
+        -------
+        num: number
+            Interger of maximun number of waveform structures
+        long_wave: bool
+            Read PL_WaveLong instead of PL_Wave structures. Defaults to IsLongWaveMode().
+
+        Returns
+        -------
+        num: number 
+            Number of actual number of waveform structures transferred
+        array: structured ndarray
+            PL_WAVE_DTYPE or PL_WAVE_LONG_DTYPE view of the first num structures, with the
+            waveforms in array['WaveForm']. The view is overwritten by the next read.
+            The dropped waveform counts of the read are kept in ServerDropped and MMFDropped.
+        """
+        if long_wave is None:
+            long_wave = bool(self.IsLongWaveMode())
+        num = self.read_waveform_structures(num, long_wave)
+        if long_wave:
+            return (num, self.ServerWavesLong[:num])
+        return (num, self.ServerWaves[:num])
+
+    def read_timestamp_structures(self, num):
+        """
+        Fill ServerEventBuffer with at most num recent PL_Event structures from
+        the server and return their number.
         """
         num = ctypes.c_int(num)
         Plexon.PL_GetTimeStampStructures(
             ctypes.byref(num), ctypes.byref(self.ServerEventBuffer[0]))
-        return (num.value, self.ServerEventBuffer)
+        return num.value
+
+    def read_waveform_structures(self, num, long_wave):
+        """
+        Fill ServerWaveBuffer, or ServerWaveLongBuffer if long_wave, with at most num
+        recent waveform structures from the server and return their number.
+        """
+        num = ctypes.c_int(num)
+        server_dropped = ctypes.c_int(0)
+        mmf_dropped = ctypes.c_int(0)
+        if long_wave:
+            Plexon.PL_GetLongWaveFormStructures(
+                ctypes.byref(num), ctypes.byref(self.ServerWaveLongBuffer[0]),
+                ctypes.byref(server_dropped), ctypes.byref(mmf_dropped))
+        else:
+            Plexon.PL_GetWaveFormStructuresEx(
+                ctypes.byref(num), ctypes.byref(self.ServerWaveBuffer[0]),
+                ctypes.byref(server_dropped), ctypes.byref(mmf_dropped))
+        self.ServerDropped = server_dropped.value
+        self.MMFDropped = mmf_dropped.value
+        return num.value
+
+    def GetSlowInfo(self):
+        """
+        GetSlowInfo() -> (frequencies, gains)
+
+        Return the sampling frequencies in Hz and the gains of the slow (AD) channels,
+        indexed by the 0-based slow channel number.
+        """
+        frequencies = (ctypes.c_int * MAX_SLOW_CHANNELS)()
+        channels = ctypes.c_int(0)
+        gains = (ctypes.c_int * MAX_SLOW_CHANNELS)()
+        Plexon.PL_GetSlowInfo256(frequencies, ctypes.byref(channels), gains)
+        return (np.array(frequencies[:channels.value], dtype=np.float64),
+                np.array(gains[:channels.value], dtype=np.float64))
+
+    def GetADBitsPerSample(self):
+        """
+        GetADBitsPerSample() -> integer
+
+        Return the resolution of the slow channel a/d converter.
+        """
+        return Plexon.PL_GetNIDAQBitsPerSample()
+
+    def StartADStreaming(self, duration=AD_BUFFER_DURATION, channels=None):
+        """
+        StartADStreaming(duration, channels)
+
+        Allocate a ring buffer of the last duration seconds for every slow channel.
+        PollADData then drains the server in bulk and fills the buffers with samples
+        scaled to volts with the channel gains, the unit of PlexFile.GetADDataArrays
+        and GetADChannels. GetADWindow reads them.
+        Parameters
+        ----------
+        duration: float
+            Seconds of samples kept for each channel.
+        channels: list
+            0-based slow channels to keep, all channels with a nonzero gain by default.
+        """
+        frequencies, gains = self.GetSlowInfo()
+        if channels is None:
+            channels = np.flatnonzero(gains > 0)
+        scale = AD_FULL_SCALE_VOLTS / 2**(self.GetADBitsPerSample() - 1)
+        self.ADBuffers = {}
+        for channel in channels:
+            self.ADBuffers[int(channel)] = PlexADRing(int(np.ceil(duration * frequencies[channel])),
+                                                      frequencies[channel], scale / gains[channel])
+
+    def PollADData(self, num=MAX_MAP_EVENTS_PER_READ, ticks=False):
+        """
+        PollADData(num, ticks) -> {'type', 'channel', 'unit', 'timestamp'}
+
+        Read waveform structures from the server, append the samples of the PL_ADDataType
+        blocks to the channel ring buffers and return the other events as GetTimeStampArrays
+        does. The server hands every event out once to either PL_GetTimeStamp* or PL_GetWave*
+        reads, so use this instead of GetTimeStampArrays while streaming.
+        """
+        if self.ADBuffers is None:
+            raise RuntimeError("AD streaming is not started.")
+        num, waves = self.GetWaveFormStructures(num)
+        event_type = waves['Type']
+        event_ticks = (waves['UpperTS'].astype(np.int64) << 32) | waves['TimeStamp']
+        ad_rows = np.flatnonzero(event_type == Plexon.PL_ADDataType)
+        if len(ad_rows):
+            channel = waves['Channel'][ad_rows]
+            ad_rows = ad_rows[np.argsort(channel, kind='mergesort')]
+            channel = waves['Channel'][ad_rows]
+            counts = waves['NumberOfDataWords'][ad_rows].view(np.uint8).astype(np.int64)
+            samples = waves['WaveForm'][ad_rows]
+            values = samples[np.arange(samples.shape[1]) < counts[:, np.newaxis]]
+            row_bounds = np.concatenate((np.flatnonzero(channel[1:] != channel[:-1]) + 1, [len(channel)]))
+            sample_bounds = np.concatenate(([0], np.cumsum(counts)))
+            first_row = 0
+            for last_row in row_bounds:
+                buf = self.ADBuffers.get(int(channel[first_row]))
+                if buf is not None:
+                    buf.write(values[sample_bounds[first_row]:sample_bounds[last_row]],
+                              event_ticks[ad_rows[last_row-1]] + (counts[last_row-1] - 1) * self.MAPSampleRate / buf.frequency)
+                first_row = last_row
+        others = event_type != Plexon.PL_ADDataType
+        data = {'type': event_type[others].astype(np.uint16),
+                'channel': waves['Channel'][others].astype(np.uint16),
+                'unit': waves['Unit'][others].astype(np.uint16)}
+        if ticks:
+            data['timestamp'] = event_ticks[others]
+        else:
+            data['timestamp'] = event_ticks[others] / self.MAPSampleRate
+        return data
+
+    def GetADWindow(self, channel, milliseconds):
+        """
+        GetADWindow(channel, milliseconds) -> (values, start)
+
+        Return a view of the latest samples of a slow channel, in volts, covering at most the last
+        milliseconds, and the time of its first sample in seconds. The view is valid until the
+        samples are overwritten by later polls.
+        """
+        buf = self.ADBuffers[channel]
+        values = buf.latest(int(milliseconds / 1000 * buf.frequency))
+        if buf.last_tick is None:
+            return values, None
+        start = buf.last_tick / self.MAPSampleRate - (len(values) - 1) / buf.frequency
+        return values, start
+
+    def StartAcquisition(self, interval=ACQUISITION_INTERVAL, capacity=ACQUISITION_CAPACITY):
+        """
+        StartAcquisition(interval, capacity)
+
+        Poll the server on a background thread every interval seconds and copy the
+        timestamps into a ring buffer of capacity events. Read them with GetAcquiredArrays.
+        GetTimeStampArrays must not be called while the acquisition is running.
+        """
+        if self.Acquisition is not None and self.Acquisition.is_alive():
+            return
+        self.Acquisition = PlexAcquisition(self, interval, capacity)
+        self.Acquisition.start()
+
+    def StopAcquisition(self):
+        """
+        StopAcquisition()
+
+        Stop the background acquisition thread. Buffered timestamps can still be read.
+        """
+        if self.Acquisition is not None:
+            self.Acquisition.stop()
+
+    def GetAcquiredArrays(self, ticks=False):
+        """
+        GetAcquiredArrays(ticks) -> {'type', 'channel', 'unit', 'timestamp'}
+
+        Return the timestamps acquired since the last call without blocking on the
+        server. The arrays are copies and are not overwritten by later reads.
+        'timestamp' is in seconds unless ticks is True, see GetTimeStampArrays.
+        """
+        if self.Acquisition is None:
+            raise RuntimeError("Acquisition is not started.")
+        data = self.Acquisition.buffer.read()
+        if not ticks:
+            data['timestamp'] = data['timestamp'] / self.MAPSampleRate
+        return data
+
+    def GetAcquisitionStats(self):
+        """
+        GetAcquisitionStats() -> stats
+
+        Return {'polls', 'events', 'server_overruns', 'dropped_events', 'buffered'}.
+        server_overruns counts polls that returned a full MAX_MAP_EVENTS_PER_READ read, i.e.
+        the server had more events waiting and may have overflowed. dropped_events counts
+        events overwritten in the ring buffer before they were read.
+        """
+        if self.Acquisition is None:
+            return None
+        return self.Acquisition.get_stats()
+
+
+class PlexRingBuffer(object):
+
+    """
+    Preallocated lock-protected ring buffer of timestamp arrays.
+    The writer overwrites the oldest unread events when the buffer is full and
+    counts them as dropped.
+    """
+
+    def __init__(self, capacity=ACQUISITION_CAPACITY):
+        self.capacity = capacity
+        self.arrays = {'type': np.empty(capacity, dtype=np.uint16),
+                       'channel': np.empty(capacity, dtype=np.uint16),
+                       'unit': np.empty(capacity, dtype=np.uint16),
+                       'timestamp': np.empty(capacity, dtype=np.int64)}
+        self.lock = threading.Lock()
+        self.write_count = 0
+        self.read_count = 0
+        self.dropped = 0
+
+    def write(self, data):
+        num = len(data['timestamp'])
+        skip = max(num - self.capacity, 0)
+        with self.lock:
+            unread = self.write_count - self.read_count
+            overflow = max(unread + num - self.capacity, 0)
+            self.dropped += overflow
+            self.read_count += overflow
+            self.write_count += skip
+            start = self.write_count % self.capacity
+            first = min(num - skip, self.capacity - start)
+            for name, array in self.arrays.iteritems():
+                array[start:start+first] = data[name][skip:skip+first]
+                array[:num-skip-first] = data[name][skip+first:]
+            self.write_count += num - skip
+
+    def read(self):
+        with self.lock:
+            start = self.read_count % self.capacity
+            num = self.write_count - self.read_count
+            first = min(num, self.capacity - start)
+            data = dict((name, np.concatenate((array[start:start+first], array[:num-first])))
+                        for name, array in self.arrays.iteritems())
+            self.read_count = self.write_count
+        return data
+
+    def __len__(self):
+        with self.lock:
+            return self.write_count - self.read_count
+
+
+class PlexADRing(object):
+
+    """
+    Preallocated ring buffer of the samples of one slow channel.
+    Every sample is written twice, at its position and one capacity further, so the
+    latest n samples are always one contiguous slice and can be returned as a view.
+    """
+
+    def __init__(self, capacity, frequency, scale):
+        self.capacity = max(capacity, 1)
+        self.frequency = frequency
+        self.scale = scale
+        self.data = np.zeros(2 * self.capacity, dtype=np.float32)
+        self.write_count = 0
+        self.last_tick = None
+
+    def write(self, values, last_tick):
+        values = values[-self.capacity:]
+        num = len(values)
+        start = self.write_count % self.capacity
+        first = min(num, self.capacity - start)
+        for offset in (0, self.capacity):
+            np.multiply(values[:first], self.scale, out=self.data[offset+start:offset+start+first], casting='unsafe')
+            np.multiply(values[first:], self.scale, out=self.data[offset:offset+num-first], casting='unsafe')
+        self.write_count += num
+        self.last_tick = last_tick
+
+    def latest(self, num):
+        num = min(num, self.capacity, self.write_count)
+        end = self.write_count % self.capacity + self.capacity
+        return self.data[end-num:end]
+
+
+class PlexAcquisition(threading.Thread):
+
+    """
+    Background thread polling a PlexClient into a PlexRingBuffer at a fixed rate.
+    The client's reused read arrays are only touched on this thread and are copied
+    into the ring buffer before the next poll.
+    """
+
+    def __init__(self, client, interval=ACQUISITION_INTERVAL, capacity=ACQUISITION_CAPACITY):
+        threading.Thread.__init__(self, name='PlexAcquisition')
+        self.daemon = True
+        self.client = client
+        self.interval = interval
+        self.buffer = PlexRingBuffer(capacity)
+        self.stop_event = threading.Event()
+        self.polls = 0
+        self.events = 0
+        self.server_overruns = 0
+        self.error = None
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                start_time = time.time()
+                while True:
+                    data = self.client.GetTimeStampArrays(ticks=True)
+                    self.buffer.write(data)
+                    self.polls += 1
+                    self.events += len(data['timestamp'])
+                    if len(data['timestamp']) < self.client.MAX_MAP_EVENTS_PER_READ:
+                        break
+                    # the server has more events waiting, drain them right away
+                    self.server_overruns += 1
+                self.stop_event.wait(max(self.interval - (time.time() - start_time), 0))
+        except Exception as error:
+            self.error = error
+            logger.exception("Plexon acquisition stopped.")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def get_stats(self):
+        return {'polls': self.polls,
+                'events': self.events,
+                'server_overruns': self.server_overruns,
+                'dropped_events': self.buffer.dropped,
+                'buffered': len(self.buffer)}
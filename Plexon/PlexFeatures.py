@@ -0,0 +1,196 @@
+#!/usr/bin/python
+#coding:utf-8
+
+###########################################################
+### Out-of-core spike waveform features of Plexon plx files
+###########################################################
+
+from __future__ import division
+import os
+import sys
+import time
+import multiprocessing
+import numpy as np
+import logging
+logger = logging.getLogger('SpikeRecord.Plexon')
+from PlexFile import PlexFile, PL_SingleWFType, PAYLOAD_CHUNK_BLOCKS
+
+FEATURES_SUFFIX = '.features'
+SPIKE_BLOCKS_NAME = 'spike_blocks.npy'
+
+def get_features_dirname(filename):
+    return filename + FEATURES_SUFFIX
+
+def get_feature_dtype(components):
+    return np.dtype([('tick', np.int64), ('unit', np.int16), ('pc', np.float32, (components,)),
+                     ('peak_to_trough', np.float32), ('peak_to_trough_samples', np.int16)])
+
+def group_spike_blocks(pf, filename):
+    """
+    Write the index records of all spikes with waveforms to filename, grouped by
+    channel and in file order within a channel, in a single pass over the index.
+    Return {channel: (start, stop)} rows of each channel in the file.
+    """
+    spikes = [chunk[(chunk['type'] == PL_SingleWFType) & (chunk['nwaves'] > 0)] for chunk in pf.iter_blocks()]
+    spikes = np.concatenate(spikes) if spikes else np.empty(0, dtype=pf.GetBlockIndex().dtype)
+    spikes = spikes[np.argsort(spikes['channel'], kind='mergesort')]
+    np.save(filename, spikes)
+    channels, starts, counts = np.unique(spikes['channel'], return_index=True, return_counts=True)
+    return dict((int(channel), (start, start + count)) for channel, start, count in zip(channels, starts, counts))
+
+def iter_channel_waveforms(pf, blocks):
+    """
+    Yield (blocks, waveforms) of the spike index records of a channel, one
+    payload chunk at a time, so that memory does not grow with the file.
+    """
+    for first in xrange(0, len(blocks), PAYLOAD_CHUNK_BLOCKS):
+        chunk = np.asarray(blocks[first:first+PAYLOAD_CHUNK_BLOCKS])
+        yield chunk, pf.read_waveforms(chunk)
+
+def get_peak_to_trough(waveforms):
+    """
+    Return the amplitude from the trough to the following peak of every waveform
+    and the number of samples between them.
+    """
+    trough = waveforms.argmin(axis=1)
+    after_trough = np.where(np.arange(waveforms.shape[1]) >= trough[:, np.newaxis], waveforms, np.iinfo(np.int16).min)
+    peak = after_trough.argmax(axis=1)
+    rows = np.arange(len(waveforms))
+    amplitude = waveforms[rows, peak].astype(np.float32) - waveforms[rows, trough]
+    return amplitude, (peak - trough).astype(np.int16)
+
+def extract_channel_features(args):
+    """
+    Process pool worker: compute the waveform features of one channel in two
+    passes over its waveforms. The first pass accumulates the mean and covariance
+    of the waveforms, the second projects them on the principal components and
+    writes the features to an .npy file. The spikes of the channel are the rows
+    start:stop of the grouped spike blocks of group_spike_blocks; spikes whose
+    waveform length differs from the most common one are skipped. Returns
+    (channel, spikes).
+    """
+    filename, dirname, channel, components, start, stop = args
+    pf = PlexFile(filename)
+    blocks = np.load(os.path.join(dirname, SPIKE_BLOCKS_NAME), mmap_mode='r')[start:stop]
+    # the principal components need one waveform length, keep the most common one
+    points = blocks['nwaves'].astype(np.int64) * blocks['nwords']
+    lengths, counts = np.unique(points, return_counts=True)
+    if len(lengths) > 1:
+        length = lengths[counts.argmax()]
+        logger.warning("Skipped %d spikes of channel %d with waveforms of other lengths than %d points."
+                       %(len(blocks) - counts.max(), channel, length))
+        blocks = blocks[points == length]
+    count = 0
+    total = None
+    products = None
+    for _blocks, waveforms in iter_channel_waveforms(pf, blocks):
+        waveforms = waveforms.astype(np.float64)
+        if total is None:
+            total = np.zeros(waveforms.shape[1])
+            products = np.zeros((waveforms.shape[1], waveforms.shape[1]))
+        count += len(waveforms)
+        total += waveforms.sum(axis=0)
+        products += np.dot(waveforms.T, waveforms)
+    if not count:
+        return channel, 0
+    mean = total / count
+    covariance = (products - count * np.outer(mean, mean)) / max(count - 1, 1)
+    variances, vectors = np.linalg.eigh(covariance)
+    order = np.argsort(variances)[::-1][:components]
+    pcs = vectors[:, order].T
+    np.savez(os.path.join(dirname, 'channel_%d_pca.npz' %channel), mean=mean, components=pcs,
+             explained_variance=variances[order])
+
+    features = np.lib.format.open_memmap(os.path.join(dirname, 'channel_%d.npy' %channel), mode='w+',
+                                         dtype=get_feature_dtype(components), shape=(count,))
+    first = 0
+    for chunk, waveforms in iter_channel_waveforms(pf, blocks):
+        last = first + len(chunk)
+        features['tick'][first:last] = chunk['tick']
+        features['unit'][first:last] = chunk['unit']
+        features['pc'][first:last, :len(pcs)] = np.dot(waveforms - mean, pcs.T)
+        amplitude, samples = get_peak_to_trough(waveforms)
+        features['peak_to_trough'][first:last] = amplitude
+        features['peak_to_trough_samples'][first:last] = samples
+        first = last
+    features.flush()
+    del features
+    return channel, count
+
+def ExtractFeatures(filename, dirname=None, components=3, channels=None, processes=1, callback=None):
+    """
+    ExtractFeatures(filename, dirname, components, channels, processes, callback) -> dirname
+
+    Parameters
+    ----------
+    filename: str
+        .plx file.
+    dirname: str
+        Output directory, filename + '.features' by default.
+    components: int
+        Number of principal components per channel.
+    channels: list
+        DSP channels, all channels with spike waveforms by default.
+    processes: int
+        Number of worker processes, each working on whole channels.
+    callback(percentage,done_channels,channels,elapsed_time,left_time)
+        Callback method reports progress over the channels.
+
+    Write the waveform features of every spike of each channel to channel_<n>.npy, a structured
+    array of 'tick', 'unit', 'pc' (principal component scores), 'peak_to_trough' (a/d units)
+    and 'peak_to_trough_samples' in file order, and the mean, components and explained variance
+    of its PCA to channel_<n>_pca.npz. The index is grouped by channel in a single pass and each
+    channel's waveforms are streamed from the file one payload chunk at a time.
+    """
+    if dirname is None:
+        dirname = get_features_dirname(filename)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    pf = PlexFile(filename)
+    # build the sidecar index once so that the workers do not all scan the file
+    pf.GetBlockIndex()
+    # one pass over the index hands every worker the spike blocks of its channel
+    blocks_filename = os.path.join(dirname, SPIKE_BLOCKS_NAME)
+    rows = group_spike_blocks(pf, blocks_filename)
+    if channels is None:
+        channels = sorted(rows)
+    args = [(filename, dirname, channel, components) + rows.get(channel, (0, 0)) for channel in channels]
+
+    start_time = time.time()
+    if processes > 1 and len(args) > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(extract_channel_features, args)
+    else:
+        pool = None
+        results = (extract_channel_features(arg) for arg in args)
+    try:
+        for done, (channel, spikes) in enumerate(results, 1):
+            logger.info("Extracted features of %d spikes of channel %d." %(spikes, channel))
+            if callback:
+                elapsed_time = time.time() - start_time
+                done_percentage = done / len(args)
+                callback(done_percentage,done,len(args),elapsed_time,elapsed_time / done_percentage * (1 - done_percentage))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        os.remove(blocks_filename)
+    return dirname
+
+def LoadFeatures(dirname, channel):
+    """
+    LoadFeatures(dirname, channel) -> (features, pca)
+
+    Return the memory mapped features of a channel and its PCA dict
+    {'mean', 'components', 'explained_variance'}.
+    """
+    features = np.load(os.path.join(dirname, 'channel_%d.npy' %channel), mmap_mode='r')
+    pca = dict(np.load(os.path.join(dirname, 'channel_%d_pca.npz' %channel)))
+    return features, pca
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "usage: python PlexFeatures.py file.plx [processes]"
+        sys.exit(1)
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+    print "features written to %s" %ExtractFeatures(sys.argv[1], processes=processes)
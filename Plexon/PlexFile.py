@@ -7,10 +7,13 @@
 ###########################################################
 
 from __future__ import division
+import os
 import time
 import numpy as np
 import logging
 import mmap
+import multiprocessing
+import struct
 logger = logging.getLogger('SpikeRecord.Plexon')
 import ctypes
 from ctypes import Structure
@@ -137,13 +140,329 @@ class PL_DataBlockHeader(Structure):
                 ('NumberOfWordsInWaveform', ctypes.c_short)]        # Number of samples per waveform in the data to follow
                 # 16 bytes
 
+#######################################/
+# Block index sidecar (*.plx.idx) Definitions
+#######################################/
+
+PL_INDEX_MAGIC_NUMBER = 0x58444950      # 'PIDX'
+PL_INDEX_VERSION = 1
+PL_INDEX_SUFFIX = '.idx'
+INDEX_CHUNK_BLOCKS = 65536              # blocks scanned per index chunk
+PAYLOAD_CHUNK_BLOCKS = 16384            # blocks decoded per vectorized payload gather
+
+# index file header (is followed by NumBlocks PL_BLOCK_INDEX_DTYPE records)
+class PL_BlockIndexHeader(Structure):
+    _fields_ = [('MagicNumber', ctypes.c_uint),         # = 0x58444950
+                ('Version', ctypes.c_int),              # Version of the index format
+                ('FileSize', ctypes.c_longlong),        # size of the indexed .plx file in bytes
+                ('FileMTime', ctypes.c_double),         # modification time of the indexed .plx file
+                ('DataOffset', ctypes.c_longlong),      # offset of the first data block
+                ('EndOffset', ctypes.c_longlong),       # offset right after the last indexed data block
+                ('NumBlocks', ctypes.c_longlong)]       # number of index records that follow
+                # 48 bytes
+
+# One record per data block. 'tick' is the full 40-bit timestamp and 'offset'
+# the byte offset of the PL_DataBlockHeader in the .plx file.
+PL_BLOCK_INDEX_DTYPE = np.dtype([('tick', np.int64),
+                                 ('offset', np.int64),
+                                 ('type', np.int16),
+                                 ('channel', np.int16),
+                                 ('unit', np.int16),
+                                 ('nwaves', np.int16),
+                                 ('nwords', np.int16)])
+
+#######################################/
+# Block scanning engines
+#######################################/
+# Every engine scans at most max_blocks blocks of the memory map starting at
+# byte offset pos and returns (records, next_pos). next_pos is the offset of
+# the first block not scanned and is left before end if that block is
+# truncated or invalid.
+
+# numpy mirror of PL_DataBlockHeader
+PL_DATA_BLOCK_HEADER_DTYPE = np.dtype([('Type', np.int16),
+                                       ('UpperByteOf5ByteTimestamp', np.uint16),
+                                       ('TimeStamp', np.uint32),
+                                       ('Channel', np.int16),
+                                       ('Unit', np.int16),
+                                       ('NumberOfWaveforms', np.int16),
+                                       ('NumberOfWordsInWaveform', np.int16)])
+
+MIN_SCAN_RUN = 8                        # blocks probed at once by the numpy engine
+MAX_SCAN_RUN = 8192
+
+def scan_blocks_ctypes(mfile, pos, end, max_blocks):
+    db_size = ctypes.sizeof(PL_DataBlockHeader)
+    records = []
+    while len(records) < max_blocks and pos + db_size <= end:
+        # pylint: disable=E1101
+        db = PL_DataBlockHeader.from_buffer_copy(mfile,pos)
+        if db.NumberOfWaveforms < 0 or db.NumberOfWordsInWaveform < 0:
+            break
+        waveform_size = db.NumberOfWaveforms * db.NumberOfWordsInWaveform * 2
+        if pos + db_size + waveform_size > end:
+            break
+        records.append(((db.UpperByteOf5ByteTimestamp << 32) | db.TimeStamp, pos,
+                        db.Type, db.Channel, db.Unit, db.NumberOfWaveforms, db.NumberOfWordsInWaveform))
+        pos += db_size + waveform_size
+    return np.array(records, dtype=PL_BLOCK_INDEX_DTYPE), pos
+
+def scan_blocks_numpy(mfile, pos, end, max_blocks):
+    # Blocks of the same size usually come in runs (spikes of one waveform
+    # length, events without payload). Blocks are stepped through one by one
+    # until a few blocks of the same size are seen. Then the next blocks
+    # are guessed to have that size too, their waveform counts are read through
+    # one strided view and the blocks up to and including the first one of a
+    # different size are kept: its position is right, only the ones after it
+    # are not. Every probe cut short doubles the run length needed before the
+    # next probe so that files without long runs are mostly stepped through.
+    # The header fields are gathered once for the whole chunk.
+    db_words = PL_DATA_BLOCK_HEADER_DTYPE.itemsize//2
+    base = pos % 2
+    words = np.frombuffer(mfile, dtype=np.int16, count=(end - base)//2, offset=base)
+    nwaves = words[6:]
+    nwords = words[7:]
+    unpack_counts = struct.Struct('<hh').unpack_from
+    word = (pos - base)//2
+    end_word = (end - base)//2
+    starts = []
+    single = []
+    n = 0
+    same = 0
+    last_step = 0
+    run = MIN_SCAN_RUN
+    threshold = MIN_SCAN_RUN
+    while n < max_blocks and word + db_words <= end_word:
+        waves, points = unpack_counts(mfile, 2*word + base + 12)
+        if waves < 0 or points < 0:
+            break
+        step = db_words + waves*points
+        if same < threshold:
+            if word + step > end_word:
+                break
+            single.append(word)
+            n += 1
+            same = same + 1 if step == last_step else 0
+            last_step = step
+            word += step
+            continue
+        if single:
+            starts.append(np.array(single, dtype=np.int64))
+            single = []
+        count = min(run, max_blocks - n, (end_word - word - db_words)//step + 1)
+        stop = word + count*step
+        steps = db_words + nwaves[word:stop:step].astype(np.int64)*nwords[word:stop:step]
+        changed = np.flatnonzero(steps != step)
+        if len(changed):
+            count = int(changed[0]) + 1
+            run = MIN_SCAN_RUN
+            threshold = min(MAX_SCAN_RUN, 2*threshold)
+            same = 0
+        else:
+            run = min(MAX_SCAN_RUN, 2*run)
+            threshold = MIN_SCAN_RUN
+        last = word + (count - 1)*step
+        last_step = int(steps[count-1])
+        if nwaves[last] < 0 or nwords[last] < 0 or last + last_step > end_word:
+            starts.append(np.arange(word, last, step))
+            n += count - 1
+            word = last
+            break
+        starts.append(np.arange(word, last + 1, step))
+        n += count
+        word = last + last_step
+    starts.append(np.array(single, dtype=np.int64))
+    starts = np.concatenate(starts)
+    records = np.empty(n, dtype=PL_BLOCK_INDEX_DTYPE)
+    records['tick'] = (words[starts+1].view(np.uint16).astype(np.int64) << 32) | \
+                      (words[starts+3].view(np.uint16).astype(np.int64) << 16) | \
+                      words[starts+2].view(np.uint16)
+    records['offset'] = 2*starts + base
+    records['type'] = words[starts]
+    records['channel'] = words[starts+4]
+    records['unit'] = words[starts+5]
+    records['nwaves'] = words[starts+6]
+    records['nwords'] = words[starts+7]
+    return records, int(2*word + base)
+
+try:
+    _block_scan = np.ctypeslib.load_library('_block_scan', os.path.dirname(os.path.abspath(__file__)))
+    _block_scan.plx_scan_blocks.restype = ctypes.c_longlong
+    _block_scan.plx_scan_blocks.argtypes = [ctypes.c_void_p, ctypes.c_longlong, ctypes.c_longlong,
+                                            ctypes.c_void_p, ctypes.c_longlong,
+                                            ctypes.POINTER(ctypes.c_longlong)]
+except OSError:
+    _block_scan = None
+    logger.info("Cannot load C version of the block scanner. Building _block_scan.c is highly recommended. We will use the numpy version this time.")
+
+def scan_blocks_c(mfile, pos, end, max_blocks):
+    records = np.empty(max_blocks, dtype=PL_BLOCK_INDEX_DTYPE)
+    next_pos = ctypes.c_longlong(pos)
+    buf = np.frombuffer(mfile, dtype=np.uint8)
+    n = _block_scan.plx_scan_blocks(buf.ctypes.data, pos, end, records.ctypes.data,
+                                    max_blocks, ctypes.byref(next_pos))
+    return records[:n], next_pos.value
+
+SCAN_ENGINES = {'c': scan_blocks_c, 'numpy': scan_blocks_numpy, 'ctypes': scan_blocks_ctypes}
+DEFAULT_SCAN_ENGINE = 'c' if _block_scan else 'numpy'
+
+def scan_blocks_until(mfile, pos, end, scan):
+    """
+    Scan the blocks starting at byte offset pos and before byte offset end,
+    including a last block reaching past end. Returns (records, next_pos);
+    next_pos is before end if the chain stops at a truncated or invalid block.
+    """
+    chunks = []
+    while True:
+        records, pos = scan(mfile, pos, end, INDEX_CHUNK_BLOCKS)
+        chunks.append(records)
+        if len(records) < INDEX_CHUNK_BLOCKS:
+            break
+    if pos < end:
+        records, pos = scan(mfile, pos, len(mfile), 1)
+        chunks.append(records)
+    return np.concatenate(chunks), pos
+
+#######################################/
+# Parallel scanning
+#######################################/
+# The data region is split into byte ranges which are scanned by a process
+# pool. Each range is resynchronised on the first position that looks like a
+# PL_DataBlockHeader and whose following SYNC_CHECK_BLOCKS headers do too. The
+# ranges are merged by following the chain from the data offset: a range whose
+# resynchronisation point is not where the previous range ended is rescanned
+# serially, so the result is always the same as a serial scan.
+
+SYNC_CHECK_BLOCKS = 8
+MAX_SORTED_UNIT = 26
+_data_block_header = struct.Struct('<hHIhhhh')
+
+def is_block_header(mfile, pos, limits):
+    """
+    Return whether the bytes at pos are a plausible data block header.
+    limits is (max DSP channel, max slow channel, NumPointsWave).
+    """
+    if pos + _data_block_header.size > len(mfile):
+        return False
+    block_type, upper, _timestamp, channel, unit, waves, words = _data_block_header.unpack_from(mfile, pos)
+    max_dsp_channel, max_slow_channel, points_wave = limits
+    if upper > 0xFF or waves < 0 or words < 0 or pos + 16 + 2*waves*words > len(mfile):
+        return False
+    if block_type == PL_SingleWFType:
+        return 0 <= channel <= max_dsp_channel and 0 <= unit <= MAX_SORTED_UNIT and \
+               waves <= 1 and words in (0, points_wave)
+    if block_type == PL_ExtEventType:
+        return 0 <= channel < 512 and waves*words == 0
+    if block_type == PL_ADDataType:
+        return 0 <= channel <= max_slow_channel and unit == 0 and waves == 1
+    return False
+
+def find_block_start(mfile, pos, end, limits):
+    """
+    Return the first position from pos and before end that starts a chain of
+    SYNC_CHECK_BLOCKS plausible headers, or of plausible headers ending at the
+    end of the file. Returns None if there is none.
+    """
+    for candidate in xrange(pos, end, 2):
+        current = candidate
+        for _i in xrange(SYNC_CHECK_BLOCKS):
+            if current == len(mfile):
+                return candidate
+            if not is_block_header(mfile, current, limits):
+                break
+            waves, words = struct.unpack_from('<hh', mfile, current + 12)
+            current += 16 + 2*waves*words
+        else:
+            return candidate
+    return None
+
+def scan_range(args):
+    """
+    Process pool worker: resynchronise on the byte range [start, end) of the
+    file and scan its blocks. Returns (sync_pos, records, next_pos).
+    """
+    filename, data_offset, start, end, engine, limits = args
+    with open(filename, 'rb') as fp:
+        mfile = mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ)
+    if start == data_offset:
+        sync_pos = start
+    else:
+        # block offsets are an even distance from the data offset
+        sync_pos = find_block_start(mfile, start + (start - data_offset) % 2, end, limits)
+    if sync_pos is None:
+        return None, np.empty(0, dtype=PL_BLOCK_INDEX_DTYPE), None
+    records, next_pos = scan_blocks_until(mfile, sync_pos, end, SCAN_ENGINES[engine])
+    return sync_pos, records, next_pos
+
+# One record per slow channel data block of a PlexADChannel. 'start' is the
+# index of the first sample of the block in PlexADChannel.values.
+PL_AD_BLOCK_DTYPE = np.dtype([('tick', np.int64),
+                              ('start', np.int64),
+                              ('count', np.int32)])
+
+SCALE_CHUNK_SAMPLES = 1 << 20           # samples converted to float per chunk
+
+class PlexADChannel(object):
+    """
+    Continuous data of one slow channel
+    
+    The samples are kept in one contiguous array. Since every data block is
+    uniformly sampled at 'rate', timestamps are stored as a table of
+    (tick, start, count) records, one for each block, and only expanded to
+    full arrays by GetTimeStamps.
+    """
+    def __init__(self, channel, values, blocks, rate, ad_frequency):
+        self.channel = channel
+        self.values = values
+        self.blocks = blocks
+        self.rate = rate
+        self.ad_frequency = ad_frequency
+        
+    def __len__(self):
+        return len(self.values)
+    
+    def GetTimeStamps(self, start=0, stop=None):
+        """
+        GetTimeStamps(start, stop) -> timestamp
+        
+        Parameters
+        ----------
+        start, stop: int
+            Range of sample indices in values. Defaults to all samples.
+        
+        Returns
+        -------
+        timestamp: array
+            float64 timestamps in seconds of values[start:stop].
+        """
+        if stop is None:
+            stop = len(self.values)
+        samples = np.arange(start, stop)
+        block = np.searchsorted(self.blocks['start'], samples, side='right') - 1
+        in_block = samples - self.blocks['start'][block]
+        ticks = self.blocks['tick'][block] + in_block*self.ad_frequency/self.rate
+        return ticks/self.ad_frequency
+
 TESTED_PLX_VERSIONS = (105,106)
 
 class PlexFile(object):
     """
     Reading Plexon plx file
+
+    The data blocks are scanned once into a block index which is cached in a
+    sidecar file (filename + '.idx'). Later opens of an unchanged file load the
+    index instead of rescanning. Set use_index=False to neither read nor write
+    the sidecar file. scan_engine is one of SCAN_ENGINES, by default the C
+    scanner if it is built and the numpy one otherwise. With processes > 1
+    the file is scanned by a pool of that many processes (on Windows only from
+    code guarded by if __name__ == '__main__').
     """
-    def __init__(self,filename):   
+    def __init__(self,filename,use_index=True,scan_engine=None,processes=1):   
+        self.filename = filename
+        self.index_filename = filename + PL_INDEX_SUFFIX
+        self.use_index = use_index
+        self.scan_engine = scan_engine or DEFAULT_SCAN_ENGINE
+        self.processes = processes
         self.file = open(filename, 'rb')
         if not self.file:
             logger.error("Could not open file " + filename)
@@ -156,6 +475,12 @@ class PlexFile(object):
         self.chan_headers = None
         self.event_headers = None
         self.slow_headers = None
+        self.block_index = None
+        # contiguous int64 ticks of the block index in time order and the
+        # indices sorting the index (None if it is in order), see get_time_ticks
+        self.time_ticks = None
+        self.time_order = None
+        self.mfile = None
         
         self.single_wf_counts = sum([self.file_header.WFCounts[i][j] for i in xrange(5) for j in xrange(130)])
         self.ext_event_counts = sum([self.file_header.EVCounts[i] for i in xrange(300)])
@@ -182,6 +507,49 @@ class PlexFile(object):
         self.file.readinto(header)
         return header
     
+    def _get_mmap(self):
+        # the map is kept open for the lifetime of this object since the
+        # arrays handed out by the readers may refer to it
+        if self.mfile is None:
+            self.mfile = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        return self.mfile
+    
+    def _get_file_stat(self):
+        stat = os.fstat(self.file.fileno())
+        return stat.st_size, stat.st_mtime
+    
+    def _get_words(self):
+        # int16 view of the data region; block payloads start at an even
+        # distance from data_offset so every payload is a slice of this view
+        mfile = self._get_mmap()
+        return np.frombuffer(mfile, dtype=np.int16,
+                             count=(len(mfile) - self.data_offset)//2, offset=self.data_offset)
+    
+    def _payload_positions(self, blocks):
+        # positions in _get_words() of every payload word of the given blocks,
+        # together with the per-block word counts and the in-block word index
+        counts = blocks['nwaves'].astype(np.int64) * blocks['nwords']
+        starts = (blocks['offset'] + ctypes.sizeof(PL_DataBlockHeader) - self.data_offset)//2
+        block_begins = np.cumsum(counts) - counts
+        in_block = np.arange(counts.sum()) - np.repeat(block_begins, counts)
+        return np.repeat(starts, counts) + in_block, counts, in_block
+    
+    def read_payloads(self, blocks):
+        """
+        Return the payload words of the given index records concatenated into
+        one int16 array. The gather is done in chunks of PAYLOAD_CHUNK_BLOCKS
+        blocks to bound the size of the temporary position arrays.
+        """
+        words = self._get_words()
+        counts = blocks['nwaves'].astype(np.int64) * blocks['nwords']
+        payloads = np.empty(counts.sum(), dtype=np.int16)
+        done = 0
+        for first in xrange(0, len(blocks), PAYLOAD_CHUNK_BLOCKS):
+            positions = self._payload_positions(blocks[first:first+PAYLOAD_CHUNK_BLOCKS])[0]
+            payloads[done:done+len(positions)] = words[positions]
+            done += len(positions)
+        return payloads
+    
     def get_datetime(self):
         year = self.file_header.Year
         month = self.file_header.Month
@@ -197,20 +565,15 @@ class PlexFile(object):
         self.event_headers = [self._get_header(PL_EventHeader) for _i in range(self.file_header.NumEventChannels)]
         self.slow_headers = [self._get_header(PL_SlowChannelHeader) for _i in range(self.file_header.NumSlowChannels)]
     
-    def read_timestamps(self, callback):
-        evtcounts = self.single_wf_counts + self.ext_event_counts
-        
-        event_type = np.zeros(evtcounts,dtype=np.uint16)
-        event_channel = np.zeros(evtcounts,dtype=np.uint16)
-        event_unit = np.zeros(evtcounts,dtype=np.uint16)
-        event_timestamp = np.zeros(evtcounts,dtype=np.float32)
-        index = 0
-        
-        ad_frequency = self.file_header.ADFrequency
-        
-        fileno = self.file.fileno()
-        mfile = mmap.mmap(fileno,0,access=mmap.ACCESS_READ)
-        #mfile = mmap.mmap(fileno,0,access=mmap.ACCESS_WRITE|mmap.ACCESS_READ,prot=mmap.PROT_READ|mmap.PROT_WRITE)
+    def scan_blocks(self, callback=None):
+        """
+        Walk the data block chain and yield chunks of PL_BLOCK_INDEX_DTYPE
+        records of at most INDEX_CHUNK_BLOCKS blocks each.
+        """
+        mfile = self._get_mmap()
+        scan = SCAN_ENGINES[self.scan_engine]
+        if scan is scan_blocks_c and _block_scan is None:
+            raise RuntimeError("The C block scanner _block_scan is not built.")
 
         # timing file processing
         start_time = time.time()
@@ -218,60 +581,430 @@ class PlexFile(object):
         current_speed = previous_speed
         end_offset = len(mfile)
         file_size = end_offset/10**6
-        nbs = 0
         
         current_pos = self.data_offset
         data_offset = self.data_offset
         db_size = ctypes.sizeof(PL_DataBlockHeader)
+        while current_pos + db_size <= end_offset:
+            records, next_pos = scan(mfile, current_pos, end_offset, INDEX_CHUNK_BLOCKS)
+            if len(records):
+                yield records
+            if len(records) < INDEX_CHUNK_BLOCKS:
+                if next_pos + db_size <= end_offset:
+                    logger.warning("Truncated or invalid data block at offset %d, the rest of the file is ignored." %next_pos)
+                break
+            current_pos = next_pos
+            
+            if callback:        # callback to indicate progress every INDEX_CHUNK_BLOCKS blocks
+                elapsed_time = time.time() - start_time
+                avg_speed = (current_pos - data_offset)/10**6/(elapsed_time)
+                current_speed = previous_speed * 0.5 + avg_speed * 0.5
+                previous_speed = current_speed
+                estimated_time_left = (end_offset - current_pos)/10**6/current_speed
+                done_size = current_pos/10**6
+                done_percentage = current_pos / end_offset
+                callback(done_percentage,done_size,file_size,elapsed_time,estimated_time_left)
+        if callback:
+            elapsed_time = time.time() - start_time
+            callback(1.0,file_size,file_size,elapsed_time,0.0)
+    
+    def scan_blocks_parallel(self, processes, callback=None):
+        """
+        Scan the data region with a pool of processes and return the list of
+        index chunks. The result is identical to list(scan_blocks()).
+        """
+        mfile = self._get_mmap()
+        scan = SCAN_ENGINES[self.scan_engine]
+        if self.chan_headers is None:
+            self.read_data_header()
+        limits = (max([h.Channel for h in self.chan_headers] + [0]),
+                  max([h.Channel for h in self.slow_headers] + [0]),
+                  self.file_header.NumPointsWave)
+        
+        start_time = time.time()
+        end_offset = len(mfile)
+        file_size = end_offset/10**6
+        pieces = processes * 4
+        bounds = np.linspace(self.data_offset, end_offset, pieces + 1).astype(np.int64)
+        ranges = [(int(bounds[i]), int(bounds[i+1])) for i in xrange(pieces) if bounds[i] < bounds[i+1]]
+        args = [(self.filename, self.data_offset, start, end, self.scan_engine, limits) for start, end in ranges]
+        
+        pool = multiprocessing.Pool(processes)
         try:
-            while(True):
-                # pylint: disable=E1101
-                db = PL_DataBlockHeader.from_buffer_copy(mfile,current_pos)
-                nbs += 1
-                if db.Type == PL_SingleWFType or db.Type == PL_ExtEventType:
-                    event_type[index] = db.Type
-                    event_channel[index] = db.Channel
-                    event_unit[index] = db.Unit
-                    event_timestamp[index] = db.TimeStamp/ad_frequency
-                    index += 1
-                waveform_size = db.NumberOfWaveforms * db.NumberOfWordsInWaveform *2
-                current_pos += db_size + waveform_size      # skip waveform block
-                
-                if callback and nbs % 30000 == 0:        # callback to indicate progress every 30000 blocks
+            chunks = []
+            expected_pos = self.data_offset
+            for (start, end), (sync_pos, records, next_pos) in zip(ranges, pool.imap(scan_range, args)):
+                if expected_pos >= end:
+                    continue    # a block of the previous range covers this whole range
+                if sync_pos != expected_pos:
+                    logger.info("Resynchronisation at offset %d missed, rescanning from %d." %(start, expected_pos))
+                    records, next_pos = scan_blocks_until(mfile, expected_pos, end, scan)
+                chunks.append(records)
+                expected_pos = next_pos
+                if callback:
                     elapsed_time = time.time() - start_time
-                    avg_speed = (current_pos - data_offset)/10**6/(elapsed_time)
-                    current_speed = previous_speed * 0.5 + avg_speed * 0.5
-                    previous_speed = current_speed
-                    estimated_time_left = (end_offset - current_pos)/10**6/current_speed
-                    done_size = current_pos/10**6
-                    done_percentage = current_pos / end_offset
-                    callback(done_percentage,done_size,file_size,elapsed_time,estimated_time_left)
-        except ValueError:
-            if callback:
-                elapsed_time = time.time() - start_time
-                callback(1.0,file_size,file_size,elapsed_time,0.0)
-            return {'type':event_type, 'channel':event_channel, 'unit':event_unit, 'timestamp':event_timestamp}
+                    done_percentage = expected_pos / end_offset
+                    estimated_time_left = elapsed_time / done_percentage * (1 - done_percentage)
+                    callback(done_percentage,expected_pos/10**6,file_size,elapsed_time,estimated_time_left)
+                if expected_pos < end:
+                    break       # the chain stops at a truncated or invalid block
+        finally:
+            pool.terminate()
+            pool.join()
+        if expected_pos + ctypes.sizeof(PL_DataBlockHeader) <= end_offset:
+            logger.warning("Truncated or invalid data block at offset %d, the rest of the file is ignored." %expected_pos)
+        if callback:
+            elapsed_time = time.time() - start_time
+            callback(1.0,file_size,file_size,elapsed_time,0.0)
+        return [chunk for chunk in chunks if len(chunk)]
+    
+    def read_index(self):
+        """
+        Load the block index from the sidecar file. Returns None if there is no
+        index file or it does not match the current size and mtime of the .plx file.
+        """
+        if not os.path.exists(self.index_filename):
+            return None
+        file_size, file_mtime = self._get_file_stat()
+        header = PL_BlockIndexHeader()
+        header_size = ctypes.sizeof(PL_BlockIndexHeader)
+        with open(self.index_filename, 'rb') as fp:
+            if fp.readinto(header) != header_size:
+                return None
+        if header.MagicNumber != PL_INDEX_MAGIC_NUMBER or header.Version != PL_INDEX_VERSION:
+            return None
+        if header.FileSize != file_size or header.FileMTime != file_mtime or \
+           header.DataOffset != self.data_offset:
+            logger.info("Block index %s is out of date." %self.index_filename)
+            return None
+        if os.path.getsize(self.index_filename) != header_size + header.NumBlocks * PL_BLOCK_INDEX_DTYPE.itemsize:
+            logger.warning("Block index %s is corrupted." %self.index_filename)
+            return None
+        if header.NumBlocks == 0:
+            return np.empty(0, dtype=PL_BLOCK_INDEX_DTYPE)
+        return np.memmap(self.index_filename, dtype=PL_BLOCK_INDEX_DTYPE, mode='r',
+                         offset=header_size, shape=(header.NumBlocks,))
+    
+    def write_index(self, chunks):
+        """
+        Write index chunks to the sidecar file. The index is written to a
+        temporary file first so that an interrupted scan never leaves a valid
+        looking but incomplete index behind.
+        """
+        file_size, file_mtime = self._get_file_stat()
+        header = PL_BlockIndexHeader()
+        header.MagicNumber = PL_INDEX_MAGIC_NUMBER
+        header.Version = PL_INDEX_VERSION
+        header.FileSize = file_size
+        header.FileMTime = file_mtime
+        header.DataOffset = self.data_offset
+        header.EndOffset = self.data_offset
+        temp_filename = self.index_filename + '.tmp'
+        with open(temp_filename, 'wb') as fp:
+            fp.write(bytearray(header))
+            for chunk in chunks:
+                chunk.tofile(fp)
+                header.NumBlocks += len(chunk)
+                last = chunk[-1]
+                header.EndOffset = last['offset'] + ctypes.sizeof(PL_DataBlockHeader) + \
+                                   last['nwaves'] * last['nwords'] * 2
+            fp.seek(0)
+            fp.write(bytearray(header))
+        if os.path.exists(self.index_filename):
+            os.remove(self.index_filename)
+        os.rename(temp_filename, self.index_filename)
+    
+    def GetBlockIndex(self, callback=None):
+        """
+        GetBlockIndex(callback) -> index
+        
+        Parameters
+        ----------
+        callback(percentage,done_size,file_size,elapsed_time,left_time)
+            Callback method reports file reading progress.
+        
+        Return the block index of the file, scanning the file on first use.
+        
+        Returns
+        -------
+        index: structured array of PL_BLOCK_INDEX_DTYPE
+            One record of 'tick', 'offset', 'type', 'channel', 'unit', 'nwaves' and 'nwords'
+            for every data block in file order. 'tick' is the 40-bit timestamp in ADFrequency ticks.
+        """
+        if self.block_index is None and self.use_index:
+            self.block_index = self.read_index()
+            if self.block_index is not None and callback:
+                file_size = self._get_file_stat()[0]/10**6
+                callback(1.0,file_size,file_size,0.0,0.0)
+        if self.block_index is None:
+            if self.processes > 1:
+                chunks = self.scan_blocks_parallel(self.processes, callback)
+            else:
+                chunks = list(self.scan_blocks(callback))
+            if self.use_index:
+                try:
+                    self.write_index(chunks)
+                except (IOError, OSError) as e:
+                    logger.warning("Could not write block index %s: %s" %(self.index_filename, e))
+            if chunks:
+                self.block_index = np.concatenate(chunks)
+            else:
+                self.block_index = np.empty(0, dtype=PL_BLOCK_INDEX_DTYPE)
+        return self.block_index
+    
+    def read_waveforms(self, blocks):
+        """
+        Return the waveforms of the given spike index records as an
+        (n_spikes, n_points) int16 array. If the blocks are equally spaced in
+        the file the result is a strided read-only view of the memory map,
+        otherwise the waveforms are gathered into a new array in one go.
+        """
+        points = np.unique(blocks['nwaves'].astype(np.int64) * blocks['nwords'])
+        if len(points) == 0:
+            return np.empty((0, 0), dtype=np.int16)
+        if len(points) > 1:
+            raise ValueError("Waveforms of different lengths %s cannot be stacked." %list(points))
+        points = points[0]
+        words = self._get_words()
+        starts = (blocks['offset'] + ctypes.sizeof(PL_DataBlockHeader) - self.data_offset)//2
+        steps = np.diff(starts)
+        if len(starts) == 1 or (steps > 0).all() and (steps == steps[0]).all():
+            step = steps[0] if len(steps) else points
+            return np.lib.stride_tricks.as_strided(words[starts[0]:], shape=(len(starts), points),
+                                                   strides=(step*words.itemsize, words.itemsize))
+        return words[starts[:,np.newaxis] + np.arange(points)]
+    
+    def get_waveform_scale(self, channel):
+        """
+        Return the factor converting spike waveform a/d values of the channel to mV.
+        """
+        if self.chan_headers is None:
+            self.read_data_header()
+        gain = [header.Gain for header in self.chan_headers if header.Channel == channel][0]
+        return self.file_header.SpikeMaxMagnitudeMV / \
+               (0.5 * 2**self.file_header.BitsPerSpikeSample * gain * self.file_header.SpikePreAmpGain)
     
-    def GetTimeStampArrays(self,callback=None):
+    def GetWaveforms(self, channel, unit=None, scaled=False, callback=None):
         """
-        GetTimeStampArrays(callback) -> {'type', 'channel', 'unit', 'timestamp'}
+        GetWaveforms(channel, unit, scaled, callback) -> waveforms
         
         Parameters
         ----------
+        channel: int
+            DSP channel, currently 1-128
+        unit: int
+            Sorted unit number, 0 for unsorted. Defaults to all units of the channel.
+        scaled: bool
+            If True waveforms are converted to mV using SpikeMaxMagnitudeMV,
+            BitsPerSpikeSample, the channel gain and SpikePreAmpGain.
         callback(percentage,done_size,file_size,elapsed_time,left_time)
             Callback method reports file reading progress.
         
+        Return spike waveforms of one channel and unit.
+        
+        Returns
+        -------
+        waveforms: array
+            (n_spikes, n_points) int16 array in file order, i.e. in the order of the spikes of this
+            channel and unit in GetTimeStampArrays. This is a read-only view of the file whenever the
+            spikes are equally spaced in it. Scaled waveforms are float32.
+        """
+        block_index = self.GetBlockIndex(callback)
+        spikes = (block_index['type'] == PL_SingleWFType) & (block_index['channel'] == channel) & \
+                 (block_index['nwaves'] > 0)
+        if unit is not None:
+            spikes &= block_index['unit'] == unit
+        waveforms = self.read_waveforms(block_index[spikes])
+        if scaled:
+            waveforms = (waveforms * self.get_waveform_scale(channel)).astype(np.float32)
+        return waveforms
+    
+    def iter_blocks(self, callback=None):
+        """
+        Yield the block index in chunks of at most INDEX_CHUNK_BLOCKS records.
+        The full index is not loaded into memory: a cached index is read through
+        its memory map and a file without one is scanned chunk by chunk.
+        """
+        if self.block_index is None and self.use_index:
+            self.block_index = self.read_index()
+        if self.block_index is not None:
+            for first in xrange(0, len(self.block_index), INDEX_CHUNK_BLOCKS):
+                yield self.block_index[first:first+INDEX_CHUNK_BLOCKS]
+        else:
+            for chunk in self.scan_blocks(callback):
+                yield chunk
+    
+    def _get_timestamp_arrays(self, events, ticks=False):
+        ad_frequency = self.file_header.ADFrequency
+        
+        event_type = events['type'].astype(np.uint16)
+        event_channel = events['channel'].astype(np.uint16)
+        event_unit = events['unit'].astype(np.uint16)
+        if ticks:
+            event_timestamp = np.array(events['tick'])
+        else:
+            event_timestamp = (events['tick'] / ad_frequency).astype(np.float32)
+        return {'type':event_type, 'channel':event_channel, 'unit':event_unit, 'timestamp':event_timestamp}
+    
+    def read_timestamps(self, callback, ticks=False):
+        index = self.GetBlockIndex(callback)
+        events = index[(index['type'] == PL_SingleWFType) | (index['type'] == PL_ExtEventType)]
+        return self._get_timestamp_arrays(events, ticks)
+    
+    def TicksToSeconds(self, ticks):
+        """
+        TicksToSeconds(ticks) -> seconds
+        
+        Convert int64 timestamp ticks as returned with ticks=True to float64 seconds.
+        """
+        return np.asarray(ticks) / self.file_header.ADFrequency
+    
+    def IterTimeStampArrays(self, batch_size=100000, types=(PL_SingleWFType, PL_ExtEventType),
+                            channels=None, callback=None, ticks=False):
+        """
+        IterTimeStampArrays(batch_size, types, channels, callback, ticks) -> iterator of {'type', 'channel', 'unit', 'timestamp'}
+        
+        Parameters
+        ----------
+        batch_size: int
+            Number of records in every batch but the last one.
+        types: sequence of int
+            Block types to return, PL_SingleWFType and PL_ExtEventType by default.
+        channels: sequence of int
+            Channels to return. Defaults to all channels.
+        callback(percentage,done_size,file_size,elapsed_time,left_time)
+            Callback method reports file reading progress when the file has no block index yet.
+        ticks: bool
+            Return 'timestamp' as int64 ticks as in GetTimeStampArrays.
+        
+        Yield timestamps in file order in batches of bounded size.
+        
+        Returns
+        -------
+        'type', 'channel', 'unit', 'timestamp': dict keys
+            Same layout as GetTimeStampArrays so every batch can be passed to PlexUtil.
+        """
+        pending = []
+        pending_size = 0
+        for chunk in self.iter_blocks(callback):
+            selected = np.in1d(chunk['type'], types)
+            if channels is not None:
+                selected &= np.in1d(chunk['channel'], channels)
+            pending.append(chunk[selected])
+            pending_size += len(pending[-1])
+            if pending_size < batch_size:
+                continue
+            events = np.concatenate(pending)
+            for first in xrange(0, len(events) - batch_size + 1, batch_size):
+                yield self._get_timestamp_arrays(events[first:first+batch_size], ticks)
+            pending = [events[len(events) - len(events) % batch_size:]]
+            pending_size = len(pending[0])
+        if pending_size:
+            yield self._get_timestamp_arrays(np.concatenate(pending), ticks)
+    
+    def GetTimeStampArrays(self,callback=None,ticks=False):
+        """
+        GetTimeStampArrays(callback, ticks) -> {'type', 'channel', 'unit', 'timestamp'}
+        
+        Parameters
+        ----------
+        callback(percentage,done_size,file_size,elapsed_time,left_time)
+            Callback method reports file reading progress.
+        ticks: bool
+            Return 'timestamp' as int64 ticks of the full 40-bit timestamp instead of seconds.
+            Use TicksToSeconds to convert them to float64 seconds when needed.
+        
         Return dictionary of all timestamps.
         
         Returns
         -------
         'type', 'channel', 'unit', 'timestamp': dict keys
             Values are four 1-D arrays of the timestamp structure fields. The array length is the actual transferred TimeStamps.
-            'timestamp' is converted to seconds.
+            'timestamp' is converted to float32 seconds unless ticks is True.
         """
-        data = self.read_timestamps(callback)
+        data = self.read_timestamps(callback, ticks)
         return data
 
+    def get_time_order(self, blocks=None):
+        """
+        Return the indices sorting the block index by tick, or None if the
+        blocks are already in time order as they normally are.
+        """
+        if blocks is None:
+            return self.get_time_ticks()[1]
+        ticks = blocks['tick']
+        if len(ticks) < 2 or (ticks[1:] >= ticks[:-1]).all():
+            return None
+        return np.argsort(ticks, kind='mergesort')
+    
+    def get_time_ticks(self):
+        """
+        Return (ticks, order), the block index ticks in time order as one contiguous
+        int64 array and the indices sorting the index or None. Both are computed once,
+        so that window queries search a plain array instead of a memory mapped field.
+        """
+        if self.time_ticks is None:
+            index = self.GetBlockIndex()
+            self.time_order = self.get_time_order(index)
+            ticks = index['tick'] if self.time_order is None else index['tick'][self.time_order]
+            self.time_ticks = np.ascontiguousarray(ticks, dtype=np.int64)
+        return self.time_ticks, self.time_order
+    
+    def get_window_ticks(self, windows):
+        """
+        Return the (n, 2) window bounds in seconds as the first int64 tick at or
+        after each bound, so that tick >= bound keeps the comparison exact.
+        """
+        return np.ceil(windows*self.file_header.ADFrequency).astype(np.int64)
+    
+    def read_window_blocks(self, windows, channels=None, types=(PL_SingleWFType, PL_ExtEventType)):
+        # index records of all windows in one array and the window of each of them
+        windows = np.asarray(windows, dtype=np.float64).reshape(-1, 2)
+        index = self.GetBlockIndex()
+        ticks, order = self.get_time_ticks()
+        window_ticks = self.get_window_ticks(windows)
+        begins = np.searchsorted(ticks, window_ticks[:,0], side='left')
+        ends = np.searchsorted(ticks, window_ticks[:,1], side='left')
+        counts = np.maximum(ends - begins, 0)
+        window = np.repeat(np.arange(len(windows)), counts)
+        rows = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(begins, counts)
+        if order is not None:
+            rows = order[rows]
+        blocks = index[rows]
+        selected = np.in1d(blocks['type'], types)
+        if channels is not None:
+            selected &= np.in1d(blocks['channel'], channels)
+        return blocks[selected], window[selected], len(windows)
+    
+    def GetTimeStampWindows(self, windows, channels=None, types=(PL_SingleWFType, PL_ExtEventType), ticks=False):
+        """
+        GetTimeStampWindows(windows, channels, types, ticks) -> [{'type', 'channel', 'unit', 'timestamp'}]
+        
+        Parameters
+        ----------
+        windows: array
+            (n, 2) array of (start, stop) times in seconds, e.g. one window per trial.
+        channels: sequence of int
+            Channels to return. Defaults to all channels.
+        types: sequence of int
+            Block types to return, PL_SingleWFType and PL_ExtEventType by default.
+        ticks: bool
+            Return 'timestamp' as int64 ticks as in GetTimeStampArrays.
+        
+        Return the timestamps with start <= timestamp < stop of every window. The windows are
+        looked up by binary search on the block index, so only the records inside them are read.
+        
+        Returns
+        -------
+        list of dict
+            One dictionary of the GetTimeStampArrays layout for every window.
+        """
+        blocks, window, nwindows = self.read_window_blocks(windows, channels, types)
+        data = self._get_timestamp_arrays(blocks, ticks)
+        bounds = np.searchsorted(window, np.arange(nwindows + 1))
+        return [dict((key, value[bounds[i]:bounds[i+1]]) for key, value in data.iteritems())
+                for i in xrange(nwindows)]
+    
     def GetNullTimeStamp(self):
         data = {}
         data['type'] = np.empty(0,dtype=np.uint16)
@@ -282,64 +1015,146 @@ class PlexFile(object):
     
     def read_ad_data(self, callback=None):
         self.read_data_header()
-        gains = [self.slow_headers[channel].Gain for channel in xrange(self.file_header.NumSlowChannels)]
-        adfreqs = [self.slow_headers[channel].ADFreq for channel in xrange(self.file_header.NumSlowChannels)]
-        
-        ad_data_counts = self.ad_data_counts
-        wf_buffer = (ctypes.c_short * 256)()
-        ad_channel = np.zeros(ad_data_counts,dtype=np.uint16)
-        ad_value = np.zeros(ad_data_counts,dtype=np.float32)
-        ad_timestamp = np.zeros(ad_data_counts,dtype=np.float32)
+        gains = np.array([self.slow_headers[channel].Gain for channel in xrange(self.file_header.NumSlowChannels)])
+        adfreqs = np.array([self.slow_headers[channel].ADFreq for channel in xrange(self.file_header.NumSlowChannels)])
+        
+        block_index = self.GetBlockIndex(callback)
+        ad_blocks = block_index[block_index['type'] == PL_ADDataType]
+        ad_data_counts = int((ad_blocks['nwaves'].astype(np.int64) * ad_blocks['nwords']).sum())
+        ad_channel = np.empty(ad_data_counts,dtype=np.uint16)
+        ad_value = np.empty(ad_data_counts,dtype=np.float32)
+        ad_timestamp = np.empty(ad_data_counts,dtype=np.float32)
         index = 0
         
         ad_frequency = self.file_header.ADFrequency
         
-        fileno = self.file.fileno()
-        mfile = mmap.mmap(fileno,0,access=mmap.ACCESS_READ)
-
-        # timing file processing
-        start_time = time.time()
-        previous_speed = 20.0
-        current_speed = previous_speed
-        end_offset = len(mfile)
-        file_size = end_offset/10**6
-        nbs = 0
+        words = self._get_words()
+        for first in xrange(0, len(ad_blocks), PAYLOAD_CHUNK_BLOCKS):
+            blocks = ad_blocks[first:first+PAYLOAD_CHUNK_BLOCKS]
+            positions, counts, in_block = self._payload_positions(blocks)
+            channel = np.repeat(blocks['channel'], counts)
+            timestamp = np.repeat(blocks['tick'], counts)
+            end = index + len(positions)
+            ad_channel[index:end] = channel
+            ad_value[index:end] = (words[positions]*5./2048.)/gains[channel]
+            ad_timestamp[index:end] = (timestamp + in_block*ad_frequency/adfreqs[channel])/ad_frequency
+            index = end
+        return {'channel':ad_channel, 'value':ad_value, 'timestamp':ad_timestamp}
         
-        current_pos = self.data_offset
-        data_offset = self.data_offset
-        db_size = ctypes.sizeof(PL_DataBlockHeader)
-        try:
-            while(True):
-                # pylint: disable=E1101
-                db = PL_DataBlockHeader.from_buffer_copy(mfile,current_pos)
-                waveform_size = db.NumberOfWaveforms * db.NumberOfWordsInWaveform * 2
-                current_pos += db_size
-                if db.Type == PL_ADDataType:
-                    channel = db.Channel
-                    ctypes.memmove(wf_buffer, mfile[current_pos:current_pos+waveform_size], waveform_size)
-                    for i in xrange(db.NumberOfWordsInWaveform):
-                        ad_channel[index] = channel
-                        ad_value[index] = (wf_buffer[i]*5./2048.)/gains[channel]
-                        ad_timestamp[index] = (db.TimeStamp + i*ad_frequency/adfreqs[channel])/ad_frequency
-                        index += 1
-                current_pos += waveform_size
-                
-                nbs += 1
-                if callback and nbs % 30000 == 0:        # callback to indicate progress every 30000 blocks
-                    elapsed_time = time.time() - start_time
-                    avg_speed = (current_pos - data_offset)/10**6/(elapsed_time)
-                    current_speed = previous_speed * 0.5 + avg_speed * 0.5
-                    previous_speed = current_speed
-                    estimated_time_left = (end_offset - current_pos)/10**6/current_speed
-                    done_size = current_pos/10**6
-                    done_percentage = current_pos / end_offset
-                    callback(done_percentage,done_size,file_size,elapsed_time,estimated_time_left)
-        except ValueError:
-            if callback:
-                elapsed_time = time.time() - start_time
-                callback(1.0,file_size,file_size,elapsed_time,0.0)
-            return {'channel':ad_channel, 'value':ad_value, 'timestamp':ad_timestamp}
+    def read_ad_channels(self, channels=None, callback=None, scaled=True):
+        self.read_data_header()
+        block_index = self.GetBlockIndex(callback)
+        ad_blocks = block_index[block_index['type'] == PL_ADDataType]
+        # group the blocks by channel keeping the file order within each channel
+        ad_blocks = ad_blocks[np.argsort(ad_blocks['channel'], kind='mergesort')]
+        if channels is None:
+            channels = np.unique(ad_blocks['channel'])
         
+        ad_frequency = self.file_header.ADFrequency
+        ad_channels = {}
+        for channel in channels:
+            begin, end = np.searchsorted(ad_blocks['channel'], [channel, channel+1])
+            blocks = ad_blocks[begin:end]
+            raw = self.read_payloads(blocks)
+            if scaled:
+                gain = self.slow_headers[channel].Gain
+                values = np.empty(len(raw), dtype=np.float32)
+                for first in xrange(0, len(raw), SCALE_CHUNK_SAMPLES):
+                    values[first:first+SCALE_CHUNK_SAMPLES] = (raw[first:first+SCALE_CHUNK_SAMPLES]*5./2048.)/gain
+            else:
+                values = raw
+            table = np.empty(len(blocks), dtype=PL_AD_BLOCK_DTYPE)
+            table['tick'] = blocks['tick']
+            table['count'] = blocks['nwaves'].astype(np.int64) * blocks['nwords']
+            table['start'] = np.cumsum(table['count']) - table['count']
+            ad_channels[int(channel)] = PlexADChannel(int(channel), values, table,
+                                                      self.slow_headers[channel].ADFreq, ad_frequency)
+        return ad_channels
+    
+    def GetADChannels(self, channels=None, callback=None, scaled=True):
+        """
+        GetADChannels(channels, callback, scaled) -> {channel: PlexADChannel}
+        
+        Parameters
+        ----------
+        channels: sequence of int
+            Slow channels (0-based) to read. Defaults to all channels with data.
+        callback(percentage,done_size,file_size,elapsed_time,left_time)
+            Callback method reports file reading progress.
+        scaled: bool
+            If True values are converted to volts as in GetADDataArrays, otherwise
+            the raw int16 a/d values are returned.
+        
+        Return dictionary of the continuous data of every requested channel.
+        
+        Returns
+        -------
+        PlexADChannel: dict values
+            'values' is one contiguous array of all samples of the channel, 'blocks' the
+            compact (tick, start, count) timestamp table. Call GetTimeStamps() for seconds.
+        """
+        return self.read_ad_channels(channels, callback, scaled)
+    
+    def GetADWindows(self, windows, channels=None):
+        """
+        GetADWindows(windows, channels) -> [{channel: {'value', 'timestamp'}}]
+        
+        Parameters
+        ----------
+        windows: array
+            (n, 2) array of (start, stop) times in seconds.
+        channels: sequence of int
+            Slow channels (0-based) to read. Defaults to all channels with data.
+        
+        Return the continuous samples with start <= timestamp < stop of every window. Only the
+        data blocks overlapping a window are decoded.
+        
+        Returns
+        -------
+        list of dict
+            For every window a dictionary of channel to {'value', 'timestamp'} arrays. Values are
+            converted to volts as in GetADDataArrays and timestamps to float64 seconds.
+        """
+        windows = np.asarray(windows, dtype=np.float64).reshape(-1, 2)
+        self.read_data_header()
+        ad_frequency = self.file_header.ADFrequency
+        index = self.GetBlockIndex()
+        ad_blocks = index[index['type'] == PL_ADDataType]
+        if channels is None:
+            channels = np.unique(ad_blocks['channel'])
+        results = [{} for _window in windows]
+        window_ticks = self.get_window_ticks(windows)
+        for channel in channels:
+            blocks = ad_blocks[ad_blocks['channel'] == channel]
+            order = self.get_time_order(blocks)
+            if order is not None:
+                blocks = blocks[order]
+            step = ad_frequency / self.slow_headers[channel].ADFreq
+            counts = blocks['nwaves'].astype(np.int64) * blocks['nwords']
+            block_ends = blocks['tick'] + counts*step
+            # blocks starting before the stop and ending after the start of a window
+            firsts = np.searchsorted(block_ends, windows[:,0]*ad_frequency, side='right')
+            lasts = np.searchsorted(np.ascontiguousarray(blocks['tick'], dtype=np.int64), window_ticks[:,1], side='left')
+            needed = np.zeros(len(blocks) + 1, dtype=np.int64)
+            np.add.at(needed, firsts, 1)
+            np.add.at(needed, np.maximum(lasts, firsts), -1)
+            needed = np.flatnonzero(np.cumsum(needed[:-1]) > 0)
+            
+            blocks = blocks[needed]
+            raw = self.read_payloads(blocks)
+            _positions, counts, in_block = self._payload_positions(blocks)
+            sample_ticks = np.repeat(blocks['tick'], counts) + in_block*step
+            values = ((raw*5./2048.)/self.slow_headers[channel].Gain).astype(np.float32)
+            if len(sample_ticks) > 1 and not (sample_ticks[1:] >= sample_ticks[:-1]).all():
+                order = np.argsort(sample_ticks, kind='mergesort')
+                sample_ticks, values = sample_ticks[order], values[order]
+            begins = np.searchsorted(sample_ticks, windows[:,0]*ad_frequency, side='left')
+            ends = np.searchsorted(sample_ticks, windows[:,1]*ad_frequency, side='left')
+            for i in xrange(len(windows)):
+                results[i][int(channel)] = {'value': values[begins[i]:ends[i]],
+                                            'timestamp': sample_ticks[begins[i]:ends[i]]/ad_frequency}
+        return results
+    
     def GetADDataArrays(self,callback=None):
         """
         GetADDataArrays(callback) -> {'channel', 'value', 'timestamp'}
@@ -359,4 +1174,3 @@ class PlexFile(object):
         """
         data = self.read_ad_data(callback)
         return data
-    
\ No newline at end of file
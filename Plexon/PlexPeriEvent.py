@@ -0,0 +1,163 @@
+#!/usr/bin/python
+#coding:utf-8
+
+###########################################################
+### Peri-event rasters and PSTHs of spike trains
+###########################################################
+
+from __future__ import division
+import numpy as np
+import logging
+logger = logging.getLogger('SpikeRecord.Plexon')
+from PlexFile import PL_ExtEventType
+
+def get_train_arrays(trains):
+    """
+    Return (timestamp, offsets) of trains given as the groups of
+    PlexUtil.GetSpikeTrainGroups or as a sequence of spike time arrays.
+    """
+    if isinstance(trains, dict):
+        return np.asarray(trains['timestamp']), np.asarray(trains['offsets'])
+    lengths = [len(train) for train in trains]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    if not len(trains):
+        return np.empty(0), offsets
+    return np.concatenate([np.asarray(train) for train in trains]), offsets
+
+def GetPeriEventRaster(events, trains, window):
+    """
+    GetPeriEventRaster(events, trains, window) -> raster
+
+    Parameters
+    ----------
+    events: array
+        event timestamps, one per trial
+    trains: dict or list
+        the groups of PlexUtil.GetSpikeTrainGroups or a list of spike time arrays,
+        each in time order and in the same unit as events
+    window: (before, after)
+        spikes in [event - before, event + after) are taken
+
+    Returns
+    -------
+    raster: dict
+        'count': (trials, units) array of spike counts
+        'offsets': array of trials*units+1 offsets; the spikes of trial i and unit j
+        are timestamp[offsets[i*units+j]:offsets[i*units+j+1]]
+        'timestamp': float64 spike times relative to their events
+
+    The spikes of each unit are located with one searchsorted over all trials,
+    so there is no loop over trials.
+    """
+    events = np.asarray(events, dtype=np.float64)
+    timestamp, train_offsets = get_train_arrays(trains)
+    before, after = window
+    units = len(train_offsets) - 1
+    first = np.empty((len(events), units), dtype=np.int64)
+    count = np.empty((len(events), units), dtype=np.int64)
+    for unit in xrange(units):
+        train = timestamp[train_offsets[unit]:train_offsets[unit+1]]
+        lo = np.searchsorted(train, events - before)
+        hi = np.searchsorted(train, events + after)
+        first[:, unit] = lo + train_offsets[unit]
+        count[:, unit] = hi - lo
+    first = first.ravel()
+    counts = count.ravel()
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    positions = np.repeat(first - offsets[:-1], counts) + np.arange(offsets[-1])
+    event_times = np.repeat(np.repeat(events, units), counts)
+    return {'count': count,
+            'offsets': offsets,
+            'timestamp': timestamp[positions] - event_times}
+
+def GetPeriEventHistogram(events, trains, window, bin_size, per_trial=False):
+    """
+    GetPeriEventHistogram(events, trains, window, bin_size, per_trial) -> psth
+
+    Parameters
+    ----------
+    events, trains, window:
+        as in GetPeriEventRaster
+    bin_size: float
+        bin width in the unit of the timestamps
+    per_trial: bool
+        return the counts of every trial instead of the trial average
+
+    Returns
+    -------
+    psth: dict
+        'edges': bin edges relative to the events
+        'count': (trials, units, bins) spike counts if per_trial
+        'rate': (units, bins) trial-averaged firing rate, spikes per unit of time
+
+    The counts are differences of the cumulative spike counts at the bin edges of
+    all trials, found with one searchsorted per unit.
+    """
+    events = np.asarray(events, dtype=np.float64)
+    timestamp, train_offsets = get_train_arrays(trains)
+    before, after = window
+    bins = int(np.ceil((before + after) / bin_size - 1e-9))
+    edges = -before + bin_size * np.arange(bins + 1)
+    units = len(train_offsets) - 1
+    rate = np.zeros((units, bins))
+    count = np.empty((len(events), units, bins), dtype=np.int32) if per_trial else None
+    times = (events[:, np.newaxis] + edges).ravel()
+    for unit in xrange(units):
+        train = timestamp[train_offsets[unit]:train_offsets[unit+1]]
+        unit_count = np.diff(np.searchsorted(train, times).reshape(len(events), bins + 1), axis=1)
+        if per_trial:
+            count[:, unit] = unit_count
+        rate[unit] = unit_count.sum(axis=0)
+    if len(events):
+        rate /= len(events) * bin_size
+    psth = {'edges': edges, 'rate': rate}
+    if per_trial:
+        psth['count'] = count
+    return psth
+
+def GetEventTimeStamps(data, channel):
+    """
+    GetEventTimeStamps(data, channel) -> timestamps
+
+    Return the timestamps of the external events of a channel, e.g. of the
+    events sent with PlexClient.MarkEvent(channel).
+    Parameters
+    ----------
+    data: dict
+        {'type', 'channel', 'unit', 'timestamp'} dictionary from PlexClient or PlexFile GetTimeStampArrays().
+    """
+    return data['timestamp'][(data['type'] == PL_ExtEventType) & (data['channel'] == channel)]
+
+def LoadSessionEvents(filename):
+    """
+    LoadSessionEvents(filename) -> events
+
+    Read the events of a session data file written by Task.save, JSON Lines of
+    {'event': name, 'time': seconds} (.jsonl) or a JSON list of them in older
+    .json files, into {name: float64 array of times}. The file is read with
+    eventlog.load_events of the task.
+    """
+    # imported here so that the rasters and PlexCCG do not need the task package
+    from SpikeRecord import eventlog
+    events = {}
+    for record in eventlog.load_events(filename):
+        if 'event' in record and 'time' in record:
+            events.setdefault(record['event'], []).append(record['time'])
+    return dict((name, np.array(times, dtype=np.float64)) for name, times in events.iteritems())
+
+def FitSessionClock(session_times, plexon_times):
+    """
+    FitSessionClock(session_times, plexon_times) -> (slope, intercept)
+
+    Fit plexon_time = slope * session_time + intercept from the session and Plexon
+    timestamps of the same marked events, e.g. the 'trial_start' events of
+    LoadSessionEvents and GetEventTimeStamps(data, 1).
+    """
+    session_times = np.asarray(session_times, dtype=np.float64)
+    plexon_times = np.asarray(plexon_times, dtype=np.float64)
+    if len(session_times) != len(plexon_times):
+        raise ValueError("%d session events do not match %d Plexon events." %(len(session_times), len(plexon_times)))
+    if len(session_times) == 1:
+        return 1.0, plexon_times[0] - session_times[0]
+    slope, intercept = np.polyfit(session_times, plexon_times, 1)
+    return slope, intercept
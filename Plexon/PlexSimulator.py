@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# coding:utf-8
+
+###########################################################
+# A simulated Plexon server with the PlexClient API
+###########################################################
+
+from __future__ import division
+import sys
+import time
+import threading
+import numpy as np
+import Plexon
+from PlexClient import PlexClient, MAX_MAP_EVENTS_PER_READ
+import logging
+logger = logging.getLogger('SpikeRecord.Plexon')
+
+SERVER_BUFFER_EVENTS = 2**20
+AD_BLOCK_SAMPLES = 50
+
+SIMULATED_EVENT_DTYPE = np.dtype([('type', np.uint16), ('channel', np.uint16),
+                                  ('unit', np.uint16), ('tick', np.int64)])
+
+
+class PlexSimulator(PlexClient):
+
+    """
+    A drop-in replacement of PlexClient that generates data instead of reading a Plexon server.
+    Spikes are Poisson with equal rates for every sorted unit, unstrobed words set random event
+    bits (external event channels 1..event_bits) at one timestamp, strobed words are random 15-bit
+    values on PL_StrobedExtChannel and AD channels report one PL_ADDataType timestamp every
+    AD_BLOCK_SAMPLES samples. MarkEvent channels are echoed back as external events.
+
+    With realtime=True the server clock follows the wall clock from InitClient, otherwise it only
+    moves with Advance(), which makes the generated data reproducible for a given seed.
+    """
+
+    def __init__(self, spike_channels=16, units=2, spike_rate=20.0, event_bits=8, event_rate=1.0,
+                 strobe_rate=1.0, ad_channels=0, ad_rate=1000.0, timestamp_tick=25, start_tick=0,
+                 realtime=True, seed=None, server_buffer=SERVER_BUFFER_EVENTS):
+        PlexClient.__init__(self)
+        self.spike_channels = spike_channels
+        self.units = units
+        self.spike_rate = spike_rate
+        self.event_bits = event_bits
+        self.event_rate = event_rate
+        self.strobe_rate = strobe_rate
+        self.ad_channels = ad_channels
+        self.ad_rate = ad_rate
+        self.timestamp_tick = timestamp_tick
+        self.start_tick = start_tick
+        self.realtime = realtime
+        self.server_buffer = server_buffer
+        self.rng = np.random.RandomState(seed)
+        self.MAPSampleRate = 1000 / timestamp_tick * 1000
+        self.start_time = None
+        self.simulated_tick = start_tick
+        self.generated_tick = start_tick
+        self.next_ad_tick = start_tick
+        self.pending = np.empty(0, dtype=SIMULATED_EVENT_DTYPE)
+        self.ServerDroppedEvents = 0
+        # the server buffer and the generator state are shared by the
+        # acquisition thread reading events and the threads marking them
+        self.lock = threading.Lock()
+
+    def InitClient(self):
+        self.reset_timestamp_unwrap()
+        with self.lock:
+            self.start_time = time.time()
+            self.simulated_tick = self.generated_tick = self.next_ad_tick = self.start_tick
+
+    def CloseClient(self):
+        self.reset_timestamp_unwrap()
+
+    def IsSortClientRunning(self):
+        return True
+
+    def GetTimeStampTick(self):
+        return self.timestamp_tick
+
+    def IsLongWaveMode(self):
+        return False
+
+    def GetSlowInfo(self):
+        return (np.repeat(float(self.ad_rate), self.ad_channels), np.ones(self.ad_channels))
+
+    def GetADBitsPerSample(self):
+        return 12
+
+    def get_ad_values(self, channel, ticks):
+        """
+        Return the simulated AD samples of the channels at the ticks, a 10 Hz
+        oscillation with a channel dependent phase plus 60 Hz line noise.
+        """
+        seconds = ticks / self.MAPSampleRate
+        values = 1000 * np.sin(2 * np.pi * 10 * seconds + channel) + 300 * np.sin(2 * np.pi * 60 * seconds)
+        return np.round(values).astype(np.int16)
+
+    def Advance(self, seconds):
+        """
+        Advance(seconds)
+
+        Move the server clock forward when not in realtime mode.
+        """
+        with self.lock:
+            self.simulated_tick += int(round(seconds * self.MAPSampleRate))
+
+    def get_current_tick(self):
+        if self.realtime:
+            if self.start_time is None:
+                self.start_time = time.time()
+            return self.start_tick + int((time.time() - self.start_time) * self.MAPSampleRate)
+        return self.simulated_tick
+
+    def poisson_ticks(self, rate, start, stop):
+        num = self.rng.poisson(rate * (stop - start) / self.MAPSampleRate)
+        return np.sort(self.rng.randint(start, stop, num).astype(np.int64))
+
+    def make_events(self, event_type, channel, unit, ticks):
+        events = np.empty(len(ticks), dtype=SIMULATED_EVENT_DTYPE)
+        events['type'] = event_type
+        events['channel'] = channel
+        events['unit'] = unit
+        events['tick'] = ticks
+        return events
+
+    def generate(self, stop):
+        """ Generate the events of the ticks up to stop into the server buffer, with the lock held. """
+        start = self.generated_tick
+        if stop <= start:
+            return
+        parts = [self.pending]
+        units = self.spike_channels * self.units
+        if units:
+            ticks = self.poisson_ticks(self.spike_rate * units, start, stop)
+            spike_units = self.rng.randint(0, units, len(ticks))
+            parts.append(self.make_events(Plexon.PL_SingleWFType, spike_units // self.units + 1,
+                                          spike_units % self.units + 1, ticks))
+        if self.event_bits:
+            ticks = self.poisson_ticks(self.event_rate, start, stop)
+            words = self.rng.randint(1, 2**self.event_bits, len(ticks))
+            word_index, bit = np.nonzero((words[:, np.newaxis] >> np.arange(self.event_bits)) & 1)
+            parts.append(self.make_events(Plexon.PL_ExtEventType, bit + 1, 0, ticks[word_index]))
+        if self.strobe_rate:
+            ticks = self.poisson_ticks(self.strobe_rate, start, stop)
+            parts.append(self.make_events(Plexon.PL_ExtEventType, Plexon.PL_StrobedExtChannel,
+                                          self.rng.randint(0, 2**15, len(ticks)), ticks))
+        if self.ad_channels:
+            block_ticks = AD_BLOCK_SAMPLES * self.MAPSampleRate / self.ad_rate
+            blocks = int(np.ceil((stop - self.next_ad_tick) / block_ticks))
+            ticks = self.next_ad_tick + np.round(np.arange(blocks) * block_ticks).astype(np.int64)
+            self.next_ad_tick += int(round(blocks * block_ticks))
+            parts.append(self.make_events(Plexon.PL_ADDataType, np.tile(np.arange(self.ad_channels), blocks),
+                                          0, np.repeat(ticks, self.ad_channels)))
+        events = np.concatenate(parts)
+        self.pending = events[np.argsort(events['tick'], kind='mergesort')]
+        self.generated_tick = stop
+        if len(self.pending) > self.server_buffer:
+            dropped = len(self.pending) - self.server_buffer
+            self.ServerDroppedEvents += dropped
+            self.pending = self.pending[dropped:]
+
+    def pop_events(self, num):
+        with self.lock:
+            self.generate(self.get_current_tick())
+            events = self.pending[:num]
+            self.pending = self.pending[num:]
+        return events
+
+    def MarkEvent(self, channel):
+        with self.lock:
+            tick = max(self.get_current_tick(), self.generated_tick)
+            self.generate(tick)
+            self.pending = np.append(self.pending, self.make_events(Plexon.PL_ExtEventType, channel, 0, [tick]))
+
+    def read_timestamp_arrays(self, num):
+        events = self.pop_events(min(num, self.MAX_MAP_EVENTS_PER_READ))
+        num = len(events)
+        self.EventTypeArray[:num] = events['type']
+        self.EventChannelArray[:num] = events['channel']
+        self.EventUnitArray[:num] = events['unit']
+        self.EventTimestampArray[:num] = events['tick'] & 0xFFFFFFFF
+        return num
+
+    def fill_structures(self, structures, events):
+        num = len(events)
+        structures[:num] = np.zeros(1, dtype=structures.dtype)
+        structures['Type'][:num] = events['type']
+        structures['UpperTS'][:num] = events['tick'] >> 32
+        structures['TimeStamp'][:num] = events['tick'] & 0xFFFFFFFF
+        structures['Channel'][:num] = events['channel']
+        structures['Unit'][:num] = events['unit']
+        return num
+
+    def read_timestamp_structures(self, num):
+        events = self.pop_events(min(num, self.MAX_MAP_EVENTS_PER_READ))
+        return self.fill_structures(self.ServerEvents, events)
+
+    def read_waveform_structures(self, num, long_wave):
+        events = self.pop_events(min(num, self.MAX_MAP_EVENTS_PER_READ))
+        self.ServerDropped = self.MMFDropped = 0
+        waves = self.ServerWavesLong if long_wave else self.ServerWaves
+        num = self.fill_structures(waves, events)
+        ad_rows = np.flatnonzero(events['type'] == Plexon.PL_ADDataType)
+        if len(ad_rows):
+            sample_ticks = events['tick'][ad_rows, np.newaxis] + \
+                np.arange(AD_BLOCK_SAMPLES) * (self.MAPSampleRate / self.ad_rate)
+            waves['NumberOfDataWords'][ad_rows] = AD_BLOCK_SAMPLES
+            waves['WaveForm'][ad_rows, :AD_BLOCK_SAMPLES] = \
+                self.get_ad_values(events['channel'][ad_rows, np.newaxis], sample_ticks)
+        return num
+
+if __name__ == "__main__":
+    # load test: poll the simulator like an online client and measure the MarkEvent echo latency
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    spike_channels = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    # no simulated unstrobed bits, which share the external event channels of the marks
+    with PlexSimulator(spike_channels=spike_channels, units=4, spike_rate=50.0, event_bits=0, ad_channels=16) as pc:
+        events = 0
+        polls = 0
+        latencies = []
+        marked = {}
+        start_time = time.time()
+        while time.time() - start_time < duration:
+            channel = polls % 8 + 1
+            marked[channel] = time.time()
+            pc.MarkEvent(channel)
+            data = pc.GetTimeStampArrays()
+            polls += 1
+            events += len(data['timestamp'])
+            echoed = (data['type'] == Plexon.PL_ExtEventType) & (data['unit'] == 0) & (data['channel'] == channel)
+            if echoed.any():
+                latencies.append(time.time() - marked[channel])
+            time.sleep(0.001)
+        elapsed = time.time() - start_time
+        print "%d polls %d events in %.1f s: %.0f events/s" % (polls, events, elapsed, events / elapsed)
+        if latencies:
+            print "MarkEvent echo latency: median %.3f ms, max %.3f ms" % (np.median(latencies) * 1e3, max(latencies) * 1e3)
+        print "server dropped events: %d" % pc.ServerDroppedEvents
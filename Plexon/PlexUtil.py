@@ -10,6 +10,14 @@ import numpy as np
 import logging
 logger = logging.getLogger('SpikeRecord.Plexon')
 from SpikeRecord import Plexon
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
 
 def reconstruct_word_in_python(WORD_BITS,bits_num,unstrobed_bits,words_buffer,timestamps_buffer):
     bits_indices = np.array([0]*WORD_BITS)
@@ -43,6 +51,74 @@ def reconstruct_word_in_python(WORD_BITS,bits_num,unstrobed_bits,words_buffer,ti
         words_count += 1
     return words_count
 
+def reconstruct_word_in_numpy(bits, timestamps):
+    """
+    reconstruct_word_in_numpy(bits, timestamps) -> (words, word_timestamps)
+
+    Reconstruct unstrobed words from bit events with one sort instead of a loop
+    over words. Bits sharing a timestamp are OR-ed into one word. As in
+    reconstruct_word_in_python a bit repeated at the same timestamp starts
+    another word at that timestamp.
+
+    Parameters
+    ----------
+    bits: array
+        bit number (0-31) of every bit event
+    timestamps: array
+        timestamps of the bit events. Float timestamps are compared in float32
+        as in reconstruct_word, integer ticks exactly.
+
+    Returns
+    -------
+    words: int32 array of words in time order
+    word_timestamps: timestamps of the words
+    """
+    bits = np.asarray(bits, dtype=np.int64)
+    timestamps = np.asarray(timestamps)
+    if timestamps.dtype.kind == 'f':
+        timestamps = timestamps.astype(np.float32)
+    order = np.lexsort((bits, timestamps))
+    bits = bits[order]
+    timestamps = timestamps[order]
+    # rank of every bit event among the events of the same bit at the same timestamp
+    positions = np.arange(len(bits))
+    new_pair = np.ones(len(bits), dtype=bool)
+    new_pair[1:] = (timestamps[1:] != timestamps[:-1]) | (bits[1:] != bits[:-1])
+    rank = positions - np.maximum.accumulate(np.where(new_pair, positions, 0))
+    if rank.any():
+        order = np.lexsort((rank, timestamps))
+        bits, timestamps, rank = bits[order], timestamps[order], rank[order]
+    new_word = np.ones(len(bits), dtype=bool)
+    new_word[1:] = (timestamps[1:] != timestamps[:-1]) | (rank[1:] != rank[:-1])
+    starts = np.flatnonzero(new_word)
+    if not len(starts):
+        return np.empty(0, dtype=np.int32), timestamps
+    words = np.bitwise_or.reduceat(np.left_shift(1, bits), starts).astype(np.int32)
+    return words, timestamps[starts]
+
+def reconstruct_word_in_matrix(bits, timestamps, WORD_BITS=32):
+    """
+    reconstruct_word_in_matrix(bits, timestamps) -> (words, word_timestamps)
+
+    Same as reconstruct_word_in_numpy using reconstruct_word on the padded
+    WORD_BITS x max_length matrix of bit timestamps. Kept for benchmarking.
+    """
+    infinity = float('inf')
+    # add an additional infinity in array end so that index of unstrobed_bits will not get out of range
+    unstrobed_bits_list = [timestamps[bits == bit] for bit in xrange(WORD_BITS)]
+    bits_length = [len(unstrobed_bits_list[bit]) for bit in xrange(WORD_BITS)] # actural bits length
+    max_length = max(bits_length)
+    bits_num = sum(bits_length)
+    # make 2d array of timestamp 
+    unstrobed_bits = np.array([np.append(unstrobed_bits_list[bit], [infinity]*(max_length-bits_length[bit]+1)) \
+                               for bit in xrange(WORD_BITS)],dtype=np.float32)
+    # create numpy buffer to hold words and timestamps
+    words_buffer = np.empty(bits_num,dtype=np.int32)
+    timestamps_buffer = np.empty(bits_num,dtype=np.float32)
+    
+    words_count = reconstruct_word(WORD_BITS,bits_num,unstrobed_bits,words_buffer,timestamps_buffer)
+    return words_buffer[:words_count], timestamps_buffer[:words_count]
+
 try:
     import _unstrobed_word
     reconstruct_word = _unstrobed_word.reconstruct_word_32
@@ -72,20 +148,57 @@ class PlexUtil(object):
         info: list of units for every spikes occurring channels
             [(channel, units)]
         """
-        sorted_spikes = (data['type'] == Plexon.PL_SingleWFType) & (data['unit'] > 0)
+        groups = self.GetSpikeTrainGroups(data)
         info = []
-        for channel in np.unique(data['channel'][sorted_spikes]):
-            channel_units = map(chr, np.unique(data['unit'][sorted_spikes & (data['channel'] == channel)]) + (ord('a')-1))
+        for channel in np.unique(groups['channel']):
+            channel_units = map(chr, groups['unit'][groups['channel'] == channel] + (ord('a')-1))
             info.append((channel, channel_units))
         return info
+    
+    def GetSpikeTrainGroups(self, data):
+        """
+        GetSpikeTrainGroups(data) -> groups
+
+        Return the spike trains of all sorted units in one pass. The sorted spikes are ordered
+        by (channel, unit) with a single stable sort, so every train is a slice of one array.
+        Parameters
+        ----------
+        data: dict 
+            {'type', 'channel', 'unit', 'timestamp'} dictionary from the return value of PlexClient.GetTimeStampArray().
+
+        Returns
+        -------
+        groups: dict
+            'channel', 'unit': arrays of the channel and unit number of every train, ordered by channel and unit
+            'offsets': array one longer than 'channel'; train i is timestamp[offsets[i]:offsets[i+1]]
+            'timestamp': timestamps of all trains, in time order within each train
+        """
+        sorted_spikes = np.flatnonzero((data['type'] == Plexon.PL_SingleWFType) & (data['unit'] > 0))
+        channel = data['channel'][sorted_spikes]
+        unit = data['unit'][sorted_spikes]
+        # 16-bit keys whenever they fit, for which numpy's stable sort is a radix sort
+        if not len(unit) or (channel.max() < 2**11 and unit.max() < 2**5):
+            shift, key_type = 5, np.uint16
+        else:
+            shift, key_type = 16, np.int64
+        keys = (channel.astype(key_type) << shift) | unit.astype(key_type)
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        offsets = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1, [len(keys)] if len(keys) else []))
+        offsets = offsets.astype(np.int64)
+        train_keys = keys[offsets[:-1]]
+        return {'channel': (train_keys >> shift).astype(np.uint16),
+                'unit': (train_keys & (2**shift - 1)).astype(np.uint16),
+                'offsets': offsets,
+                'timestamp': data['timestamp'][sorted_spikes[order]]}
         
     def GetSpikeTrains(self,data):
         spike_trains = {}
-        sorted_spikes = (data['type'] == Plexon.PL_SingleWFType) & (data['unit'] > 0)
-        for channel in np.unique(data['channel'][sorted_spikes]):
-            spike_trains[channel] = {}
-            for unit in map(chr,np.unique(data['unit'][sorted_spikes & (data['channel'] == channel)]) + (ord('a')-1)):
-                spike_trains[channel][unit] = self.GetSpikeTrain(data, channel=channel, unit=unit)
+        groups = self.GetSpikeTrainGroups(data)
+        offsets = groups['offsets']
+        for i, (channel, unit) in enumerate(zip(groups['channel'], groups['unit'])):
+            channel_trains = spike_trains.setdefault(channel, {})
+            channel_trains[chr(unit + ord('a')-1)] = groups['timestamp'][offsets[i]:offsets[i+1]]
         return spike_trains
             
     def GetSpikeTrain(self, data, channel, unit):
@@ -113,6 +226,97 @@ class PlexUtil(object):
 
         return np.copy(data['timestamp'][unit_spikes])
     
+    def GetBinnedCounts(self, data, bin_size, start=0, stop=None, sparse_output=False):
+        """
+        GetBinnedCounts(data, bin_size, start, stop, sparse_output) -> binned
+
+        Return the spike counts of all sorted units in time bins, with one bincount of the
+        combined (unit, bin) index.
+        Parameters
+        ----------
+        data: dict 
+            {'type', 'channel', 'unit', 'timestamp'} dictionary from the return value of PlexClient.GetTimeStampArray().
+        bin_size: float
+            bin width in the unit of the timestamps
+        start, stop: float
+            time range of the bins, stop defaults to the last timestamp
+        sparse_output: bool
+            return the counts as a scipy.sparse csr_matrix
+
+        Returns
+        -------
+        binned: dict
+            'channel', 'unit': arrays of the channel and unit number of every row, as in GetSpikeTrainGroups
+            'edges': bin edges
+            'count': (units, bins) int32 array or csr_matrix of spike counts
+        """
+        groups = self.GetSpikeTrainGroups(data)
+        if stop is None:
+            stop = data['timestamp'].max() if len(data['timestamp']) else start
+        bins = max(int(np.ceil((stop - start) / float(bin_size))), 1)
+        units = len(groups['channel'])
+        row = np.repeat(np.arange(units), np.diff(groups['offsets']))
+        column = np.floor((groups['timestamp'] - start) / float(bin_size)).astype(np.int64)
+        # the last spike at stop belongs to the last bin
+        column[(column == bins) & (groups['timestamp'] <= stop)] = bins - 1
+        valid = (column >= 0) & (column < bins)
+        row, column = row[valid], column[valid]
+        if sparse_output:
+            if sparse is None:
+                raise ImportError("scipy is required for sparse output.")
+            count = sparse.csr_matrix((np.ones(len(row), dtype=np.int32), (row, column)), shape=(units, bins))
+        else:
+            count = np.bincount(row * bins + column, minlength=units * bins).astype(np.int32).reshape(units, bins)
+        return {'channel': groups['channel'],
+                'unit': groups['unit'],
+                'edges': start + bin_size * np.arange(bins + 1),
+                'count': count}
+
+    def SmoothRates(self, count, bin_size, kernel='boxcar', width=5):
+        """
+        SmoothRates(count, bin_size, kernel, width) -> rates
+
+        Return the firing rates of binned counts, spikes per unit of time, smoothed along the
+        bins with a causal kernel so that bin i only depends on bins up to i.
+        Parameters
+        ----------
+        count: array or sparse matrix
+            (units, bins) spike counts of GetBinnedCounts
+        bin_size: float
+            bin width of the counts
+        kernel: str
+            None, 'boxcar' (mean of the last width bins) or 'exponential' (exponentially weighted
+            mean with a decay of width bins, y[i] = a * y[i-1] + (1 - a) * x[i], a = exp(-1 / width))
+        width: int or float
+            kernel width in bins, at least 1 for the boxcar and positive for the exponential
+        """
+        if sparse is not None and sparse.issparse(count):
+            count = count.toarray()
+        count = np.asarray(count, dtype=np.float64)
+        if kernel is None:
+            return count / bin_size
+        if kernel == 'boxcar':
+            if width < 1:
+                raise ValueError("Boxcar width must be at least one bin, got %s." %width)
+            width = int(width)
+            cumulative = np.cumsum(count, axis=1)
+            rates = cumulative.copy()
+            rates[:, width:] -= cumulative[:, :-width]
+            return rates / (width * bin_size)
+        if kernel == 'exponential':
+            if width <= 0:
+                raise ValueError("Exponential width must be positive, got %s." %width)
+            decay = np.exp(-1.0 / width)
+            if lfilter is not None:
+                rates = lfilter([1 - decay], [1, -decay], count, axis=1)
+            else:
+                # the same recursion, one bin at a time for all units at once
+                rates = (1 - decay) * count
+                for column in xrange(1, count.shape[1]):
+                    rates[:, column] += decay * rates[:, column-1]
+            return rates / bin_size
+        raise ValueError("Unknown smoothing kernel %s." %kernel)
+
     def GetEventsNum(self, data):
         return len(data['timestamp'])
     
@@ -168,24 +372,10 @@ class PlexUtil(object):
             return timestamp[channel == bit + 1 ]
         # reconstruct unstrobed word from unstrobed bits
         if event == 'unstrobed_word':
-            infinity = float('inf')
             WORD_BITS = 32
-            # add an additional infinity in array end so that index of unstrobed_bits will not get out of range
-            unstrobed_bits_list = [timestamp[channel == bit+1] for bit in xrange(WORD_BITS)]
-            bits_length = [len(unstrobed_bits_list[bit]) for bit in xrange(WORD_BITS)] # actural bits length
-            max_length = max(bits_length)
-            bits_num = sum(bits_length)
-            # make 2d array of timestamp 
-            unstrobed_bits = np.array([np.append(unstrobed_bits_list[bit], [infinity]*(max_length-bits_length[bit]+1)) \
-                                       for bit in xrange(WORD_BITS)],dtype=np.float32)
-            # create numpy buffer to hold words and timestamps
-            words_buffer = np.empty(bits_num,dtype=np.int32)
-            timestamps_buffer = np.empty(bits_num,dtype=np.float32)
+            unstrobed_bits = (channel >= 1) & (channel <= WORD_BITS)
+            words, timestamps = reconstruct_word_in_numpy(channel[unstrobed_bits] - 1, timestamp[unstrobed_bits])
             
-            words_count = reconstruct_word(WORD_BITS,bits_num,unstrobed_bits,words_buffer,timestamps_buffer)
-            
-            words = words_buffer[:words_count]
-            timestamps = timestamps_buffer[:words_count]
             if len(timestamps) and self.last_timestamp == timestamps[0]:
                 words[0] += self.last_word
             elif self.last_word is not None:
@@ -202,3 +392,235 @@ class PlexUtil(object):
                 return {'value': np.array(words[:-1]), 'timestamp': np.array(timestamps[:-1])}
             else:
                 return {'value': np.array(words), 'timestamp': np.array(timestamps)}
+
+class TimeStampBuffer(object):
+    """
+    Growing buffer of the recent timestamps of one unit or event channel
+
+    Timestamps are appended at the end of one contiguous array and dropped from
+    its front, so every query is a view of the array. When the array is full the
+    live timestamps are moved to its front, and the array is doubled if they
+    would still fill more than half of it. Appends are amortised O(batch).
+    """
+    def __init__(self, dtype=np.float32, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.start = 0
+        self.stop = 0
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def append(self, timestamps):
+        num = len(timestamps)
+        if self.stop + num > len(self.data):
+            live = self.stop - self.start
+            capacity = len(self.data)
+            while live + num > capacity // 2:
+                capacity *= 2
+            if capacity != len(self.data):
+                data = np.empty(capacity, dtype=self.data.dtype)
+            else:
+                data = self.data
+            data[:live] = self.data[self.start:self.stop]
+            self.data, self.start, self.stop = data, 0, live
+        self.data[self.stop:self.stop+num] = timestamps
+        self.stop += num
+
+    def trim(self, before):
+        """ Drop the timestamps earlier than before. """
+        self.start += np.searchsorted(self.data[self.start:self.stop], before)
+
+    def GetTimeStamps(self, start=None, stop=None):
+        """
+        GetTimeStamps(start, stop) -> timestamps
+
+        Return a view of the buffered timestamps in [start, stop). The view is
+        only valid until the next append.
+        """
+        timestamps = self.data[self.start:self.stop]
+        first = 0 if start is None else np.searchsorted(timestamps, start)
+        last = len(timestamps) if stop is None else np.searchsorted(timestamps, stop)
+        return timestamps[first:last]
+
+class PlexOnlineBuffer(object):
+    """
+    Accumulating the spike trains and external events of online batches
+
+    Every batch from PlexClient.GetTimeStampArrays is grouped once and appended to
+    a TimeStampBuffer per (channel, unit) and per external event channel, instead of
+    concatenating the whole history with np.append.
+    """
+    def __init__(self, retention=None):
+        """
+        Parameters
+        ----------
+        retention: float
+            timestamps older than retention before the last timestamp are dropped, in the
+            unit of the timestamps (seconds, or ticks with GetTimeStampArrays(ticks=True)).
+            None keeps the whole session.
+        """
+        self.retention = retention
+        self.util = PlexUtil()
+        self.spike_buffers = {}
+        self.event_buffers = {}
+        self.last_timestamp = None
+
+    def _get_buffer(self, buffers, key, dtype):
+        if key not in buffers:
+            buffers[key] = TimeStampBuffer(dtype)
+        return buffers[key]
+
+    def Append(self, data):
+        """
+        Append(data)
+
+        Add a batch of PlexClient.GetTimeStampArrays to the buffers.
+        Parameters
+        ----------
+        data: dict
+            {'type', 'channel', 'unit', 'timestamp'} dictionary from the return value of PlexClient.GetTimeStampArray().
+        """
+        dtype = data['timestamp'].dtype
+        groups = self.util.GetSpikeTrainGroups(data)
+        offsets = groups['offsets']
+        for i, (channel, unit) in enumerate(zip(groups['channel'], groups['unit'])):
+            buf = self._get_buffer(self.spike_buffers, (int(channel), int(unit)), dtype)
+            buf.append(groups['timestamp'][offsets[i]:offsets[i+1]])
+
+        ext_events = data['type'] == Plexon.PL_ExtEventType
+        channel = data['channel'][ext_events]
+        timestamp = data['timestamp'][ext_events]
+        order = np.argsort(channel, kind='mergesort')
+        channel, timestamp = channel[order], timestamp[order]
+        starts = np.flatnonzero(np.concatenate(([True], channel[1:] != channel[:-1]))) if len(channel) else []
+        for first, last in zip(starts, list(starts[1:]) + [len(channel)]):
+            buf = self._get_buffer(self.event_buffers, int(channel[first]), dtype)
+            buf.append(timestamp[first:last])
+
+        if len(data['timestamp']):
+            self.last_timestamp = data['timestamp'][-1]
+            if self.retention is not None:
+                for buf in self.spike_buffers.values() + self.event_buffers.values():
+                    buf.trim(self.last_timestamp - self.retention)
+
+    def GetUnits(self):
+        """ Return the sorted list of (channel, unit) with buffered spikes, unit in a-z. """
+        return [(channel, chr(unit + ord('a')-1)) for channel, unit in sorted(self.spike_buffers)
+                if len(self.spike_buffers[(channel, unit)])]
+
+    def GetSpikeTrain(self, channel, unit, start=None, stop=None):
+        """
+        GetSpikeTrain(channel, unit, start, stop) -> spike_train
+
+        Return a view of the buffered spikes of the specific unit in [start, stop).
+        Parameters
+        ----------
+        channel: int 
+            currently 1-128
+        unit: str 
+            a-z
+        """
+        buf = self.spike_buffers.get((channel, ord(unit)-ord('a')+1))
+        if buf is None:
+            return np.empty(0)
+        return buf.GetTimeStamps(start, stop)
+
+    def GetRecentSpikes(self, channel, unit, duration):
+        """ Return a view of the spikes of the specific unit in the last duration before the last timestamp. """
+        if self.last_timestamp is None:
+            return np.empty(0)
+        return self.GetSpikeTrain(channel, unit, self.last_timestamp - duration)
+
+    def GetEvents(self, channel, start=None, stop=None):
+        """
+        GetEvents(channel, start, stop) -> timestamps
+
+        Return a view of the buffered external events of the channel in [start, stop).
+        channel is the external event channel as in Plexon.PL_StartExtChannel or bit + 1.
+        """
+        buf = self.event_buffers.get(channel)
+        if buf is None:
+            return np.empty(0)
+        return buf.GetTimeStamps(start, stop)
+
+class PlexRateBinner(object):
+    """
+    Streaming spike counts of the trailing time bins of all sorted units
+
+    Every batch from PlexClient.GetTimeStampArrays is added to a (units, bins) count
+    matrix with one bincount. When the batch reaches past the last bin the matrix is
+    shifted so that it always holds the latest bins. Rows are added for new units.
+    """
+    def __init__(self, bin_size, bins):
+        """
+        Parameters
+        ----------
+        bin_size: float
+            bin width in the unit of the timestamps
+        bins: int
+            number of trailing bins kept
+        """
+        self.bin_size = bin_size
+        self.bins = bins
+        self.util = PlexUtil()
+        self.rows = {}
+        self.keys = []
+        self.count = np.zeros((0, bins), dtype=np.int32)
+        self.start = None
+
+    def _shift(self, shift):
+        if shift >= self.bins:
+            self.count[:] = 0
+        else:
+            self.count[:, :-shift] = self.count[:, shift:]
+            self.count[:, -shift:] = 0
+        self.start += shift * self.bin_size
+
+    def Append(self, data):
+        """
+        Append(data)
+
+        Add a batch of PlexClient.GetTimeStampArrays to the counts.
+        """
+        if not len(data['timestamp']):
+            return
+        if self.start is None:
+            self.start = np.floor(data['timestamp'][0] / float(self.bin_size)) * self.bin_size
+        last = int(np.floor((data['timestamp'][-1] - self.start) / float(self.bin_size)))
+        if last >= self.bins:
+            self._shift(last - self.bins + 1)
+        groups = self.util.GetSpikeTrainGroups(data)
+        group_rows = np.empty(len(groups['channel']), dtype=np.int64)
+        for i, key in enumerate(zip(groups['channel'], groups['unit'])):
+            key = (int(key[0]), int(key[1]))
+            if key not in self.rows:
+                self.rows[key] = len(self.keys)
+                self.keys.append(key)
+            group_rows[i] = self.rows[key]
+        if len(self.keys) > len(self.count):
+            self.count = np.vstack((self.count, np.zeros((len(self.keys) - len(self.count), self.bins), dtype=np.int32)))
+        row = np.repeat(group_rows, np.diff(groups['offsets']))
+        column = np.floor((groups['timestamp'] - self.start) / float(self.bin_size)).astype(np.int64)
+        # spikes of bins already shifted out are dropped
+        valid = (column >= 0) & (column < self.bins)
+        self.count += np.bincount(row[valid] * self.bins + column[valid],
+                                  minlength=self.count.size).astype(np.int32).reshape(self.count.shape)
+
+    def GetCounts(self):
+        """
+        GetCounts() -> binned
+
+        Return {'channel', 'unit', 'edges', 'count'} of the trailing bins as GetBinnedCounts,
+        with the rows in the order the units were first seen. count is a view of the
+        internal matrix, valid until the next Append.
+        """
+        keys = np.array(self.keys, dtype=np.uint16).reshape(-1, 2)
+        start = self.start if self.start is not None else 0
+        return {'channel': keys[:, 0],
+                'unit': keys[:, 1],
+                'edges': start + self.bin_size * np.arange(self.bins + 1),
+                'count': self.count}
+
+    def GetRates(self, kernel='boxcar', width=5):
+        """ Return the smoothed rates of the trailing bins, see PlexUtil.SmoothRates. """
+        return self.util.SmoothRates(self.count, self.bin_size, kernel, width)
@@ -20,12 +20,15 @@ logger.addHandler(log_handler_stderr)
 
 import os
 import ctypes
+from ctypes import Structure
 try:
-    from ctypes import Structure, windll
+    from ctypes import windll
     from ctypes.wintypes import HWND
-except ImportError or ValueError:
-    logger.warning('Cannot import Plexon dynamic library in your system.')
-    raise
+except (ImportError, ValueError):
+    # no PlexClient.dll outside Windows, PlexSimulator offers the client API instead
+    windll = None
+    HWND = ctypes.c_void_p
+    logger.info('Cannot import Plexon dynamic library in your system.')
 
 
 
@@ -60,7 +63,7 @@ class PL_Event(Structure):
                 ('NumberOfBlocksInRecord', ctypes.c_byte),    ## reserved
                 ('BlockNumberInRecord', ctypes.c_byte),       ## reserved
                 ('UpperTS', ctypes.c_ubyte),                  ## Upper 8 bits of the 40-bit timestamp
-                ('TimeStamp', ctypes.c_ulong),                ## Lower 32 bits of the 40-bit timestamp
+                ('TimeStamp', ctypes.c_uint32),               ## Lower 32 bits of the 40-bit timestamp
                 ('Channel', ctypes.c_short),                  ## Channel that this came from, or Event number
                 ('Unit', ctypes.c_short),                     ## Unit classification, or Event strobe value
                 ('DataType', ctypes.c_byte),                  ## reserved
@@ -76,7 +79,7 @@ class PL_Wave(Structure):
                 ('NumberOfBlocksInRecord', ctypes.c_byte),    ## reserved
                 ('BlockNumberInRecord', ctypes.c_byte),       ## reserved
                 ('UpperTS', ctypes.c_ubyte),                  ## Upper 8 bits of the 40-bit timestamp
-                ('TimeStamp', ctypes.c_ulong),                ## Lower 32 bits of the 40-bit timestamp
+                ('TimeStamp', ctypes.c_uint32),               ## Lower 32 bits of the 40-bit timestamp
                 ('Channel', ctypes.c_short),                  ## Channel that this came from, or Event number
                 ('Unit', ctypes.c_short),                     ## Unit classification, or Event strobe value
                 ('DataType', ctypes.c_byte),                  ## reserved
@@ -93,7 +96,7 @@ class PL_WaveLong(Structure):
                 ('NumberOfBlocksInRecord', ctypes.c_byte),   ## reserved
                 ('BlockNumberInRecord', ctypes.c_byte),      ## reserved
                 ('UpperTS', ctypes.c_ubyte),                 ## Upper 8 bits of the 40-bit timestamp
-                ('TimeStamp', ctypes.c_ulong),               ## Lower 32 bits of the 40-bit timestamp
+                ('TimeStamp', ctypes.c_uint32),              ## Lower 32 bits of the 40-bit timestamp
                 ('Channel', ctypes.c_short),                 ## Channel that this came from, or Event number
                 ('Unit', ctypes.c_short),                    ## Unit classification, or Event strobe value
                 ('DataType', ctypes.c_byte),                 ## reserved
@@ -108,7 +111,8 @@ try:
     _lib = windll.LoadLibrary(os.path.join(dirname, libname))
 except:
     _lib = None
-    logger.warning("Could not find PlexClient.dll in your system.")
+    if windll is not None:
+        logger.warning("Could not find PlexClient.dll in your system.")
 else:
     PL_InitClient = _lib.PL_InitClient
     PL_InitClient.argtypes = [ctypes.c_int, HWND]
@@ -131,6 +135,15 @@ else:
     PL_GetTimeStampStructures = _lib.PL_GetTimeStampStructures
     PL_GetTimeStampStructures.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.POINTER(PL_Event)]
     PL_GetTimeStampStructures.restype = None
+    PL_GetWaveFormStructures = _lib.PL_GetWaveFormStructures
+    PL_GetWaveFormStructures.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.POINTER(PL_Wave)]
+    PL_GetWaveFormStructures.restype = None
+    PL_GetWaveFormStructuresEx = _lib.PL_GetWaveFormStructuresEx
+    PL_GetWaveFormStructuresEx.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.POINTER(PL_Wave), ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+    PL_GetWaveFormStructuresEx.restype = None
+    PL_GetLongWaveFormStructures = _lib.PL_GetLongWaveFormStructures
+    PL_GetLongWaveFormStructures.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.POINTER(PL_WaveLong), ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+    PL_GetLongWaveFormStructures.restype = None
     PL_SendUserEvent = _lib.PL_SendUserEvent
     PL_SendUserEvent.argtypes = [ctypes.c_int]
     PL_SendUserEvent.restype = None
@@ -224,6 +237,9 @@ else:
     PL_IsNidaqServer = _lib.PL_IsNidaqServer
     PL_IsNidaqServer.argtypes = []
     PL_IsNidaqServer.restype = ctypes.c_int
+    PL_GetNIDAQBitsPerSample = _lib.PL_GetNIDAQBitsPerSample
+    PL_GetNIDAQBitsPerSample.argtypes = []
+    PL_GetNIDAQBitsPerSample.restype = ctypes.c_int
     PL_GetName = _lib.PL_GetName
     PL_GetName.argtypes = [ctypes.c_int, ctypes.c_char_p]
     PL_GetName.restype = None
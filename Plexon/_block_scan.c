@@ -0,0 +1,81 @@
+/*
+ * Walk the data block chain of a Plexon .plx file.
+ *
+ * This is a plain C library loaded with ctypes by PlexFile.py, so it does not
+ * depend on the Python or NumPy C API. Build it next to PlexFile.py with
+ *
+ *     gcc -O2 -shared -fPIC -o _block_scan.so _block_scan.c
+ *     cl /O2 /LD _block_scan.c                               (Windows)
+ *
+ * See LICENSE.TXT that came with this file.
+ *
+ */
+
+#include <string.h>
+
+#ifdef _WIN32
+#define EXPORT __declspec(dllexport)
+#else
+#define EXPORT
+#endif
+
+#pragma pack(push, 1)
+
+/* PL_DataBlockHeader in PlexFile.py, 16 bytes */
+typedef struct {
+	short Type;
+	unsigned short UpperByteOf5ByteTimestamp;
+	unsigned int TimeStamp;
+	short Channel;
+	short Unit;
+	short NumberOfWaveforms;
+	short NumberOfWordsInWaveform;
+} PL_DataBlockHeader;
+
+/* PL_BLOCK_INDEX_DTYPE in PlexFile.py, 26 bytes */
+typedef struct {
+	long long tick;
+	long long offset;
+	short type;
+	short channel;
+	short unit;
+	short nwaves;
+	short nwords;
+} PL_BlockIndexRecord;
+
+#pragma pack(pop)
+
+/*
+ * Scan at most max_blocks data blocks of buf starting at byte offset pos and
+ * ending before byte offset end. The records are written to index and the
+ * number of records is returned. *next_pos is set to the offset of the first
+ * block not scanned; it is left before end if that block is truncated or has
+ * negative waveform counts.
+ */
+EXPORT long long plx_scan_blocks(const char *buf, long long pos, long long end,
+								 PL_BlockIndexRecord *index, long long max_blocks,
+								 long long *next_pos)
+{
+	PL_DataBlockHeader db;
+	long long n = 0, size;
+
+	while (n < max_blocks && pos + (long long)sizeof(db) <= end) {
+		memcpy(&db, buf + pos, sizeof(db));
+		if (db.NumberOfWaveforms < 0 || db.NumberOfWordsInWaveform < 0)
+			break;
+		size = sizeof(db) + 2 * (long long)db.NumberOfWaveforms * db.NumberOfWordsInWaveform;
+		if (pos + size > end)
+			break;
+		index[n].tick = ((long long)db.UpperByteOf5ByteTimestamp << 32) | db.TimeStamp;
+		index[n].offset = pos;
+		index[n].type = db.Type;
+		index[n].channel = db.Channel;
+		index[n].unit = db.Unit;
+		index[n].nwaves = db.NumberOfWaveforms;
+		index[n].nwords = db.NumberOfWordsInWaveform;
+		pos += size;
+		n++;
+	}
+	*next_pos = pos;
+	return n;
+}
@@ -0,0 +1,37 @@
+#!/usr/bin/pyhton
+# Benchmark the PlexFile block scanning engines.
+# usage: python benchPlexFile.py file.plx [repeats]
+import os
+import sys
+import time
+import numpy as np
+import PlexFile
+from PlexFile import PlexFile as PlexFileReader
+
+def bench_scan(filename, engine, repeats=3):
+    best = float('inf')
+    for _i in range(repeats):
+        pf = PlexFileReader(filename, use_index=False, scan_engine=engine)
+        start_time = time.time()
+        index = pf.GetBlockIndex()
+        best = min(best, time.time() - start_time)
+    return index, best
+
+if __name__ == "__main__":
+    filename = sys.argv[1] if len(sys.argv) > 1 else '../../data/sparse-noise.plx'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    engines = ['ctypes', 'numpy']
+    if PlexFile._block_scan is not None:
+        engines.append('c')
+    else:
+        print "C block scanner is not built, skipping it."
+
+    data_size = (os.path.getsize(filename) - PlexFileReader(filename, use_index=False).data_offset)/1e6
+    reference = None
+    for engine in engines:
+        index, elapsed = bench_scan(filename, engine, repeats)
+        if reference is None:
+            reference = index
+        identical = np.array_equal(index, reference)
+        print "%-7s %9d blocks %8.3f s %9.1f MB/s %s" % (engine, len(index), elapsed, data_size/elapsed,
+                                                         'ok' if identical else 'MISMATCH')
@@ -0,0 +1,53 @@
+#!/usr/bin/pyhton
+# Benchmark the PlexUtil unstrobed word reconstruction engines.
+# usage: python benchPlexUtil.py [words] [repeats]
+import sys
+import time
+import numpy as np
+import PlexUtil
+from PlexUtil import reconstruct_word_in_numpy, reconstruct_word_in_matrix, reconstruct_word_in_python
+
+def make_bits(words, seed=0):
+    # random words at 1 ms steps with bit 0 set in every word so that one bit fires far more than the others
+    rng = np.random.RandomState(seed)
+    values = rng.randint(0, 1 << 16, words) | 1
+    timestamps = (np.arange(words) / 1000.0).astype(np.float32)
+    bits = np.arange(32)
+    fired = (values[:, np.newaxis] >> bits) & 1 == 1
+    word_index, bit = np.nonzero(fired)
+    return bit, timestamps[word_index]
+
+def bench(engine, bits, timestamps, repeats=3):
+    best = float('inf')
+    for _i in range(repeats):
+        start_time = time.time()
+        result = engine(bits, timestamps)
+        best = min(best, time.time() - start_time)
+    return result, best
+
+def matrix_engine(reconstruct):
+    def engine(bits, timestamps):
+        PlexUtil.reconstruct_word = reconstruct
+        return reconstruct_word_in_matrix(bits, timestamps)
+    return engine
+
+if __name__ == "__main__":
+    words = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    bits, timestamps = make_bits(words)
+    engines = [('numpy', reconstruct_word_in_numpy), ('python', matrix_engine(reconstruct_word_in_python))]
+    default_engine = PlexUtil.reconstruct_word
+    if default_engine is not reconstruct_word_in_python:
+        engines.append(('c', matrix_engine(default_engine)))
+    else:
+        print "C version of reconstruct_word is not built, skipping it."
+
+    reference = None
+    for name, engine in engines:
+        (result_words, result_timestamps), elapsed = bench(engine, bits, timestamps, repeats)
+        if reference is None:
+            reference = result_words, result_timestamps
+        identical = np.array_equal(result_words, reference[0]) and np.array_equal(result_timestamps, reference[1])
+        print "%-7s %9d bits %9d words %8.3f s %s" % (name, len(bits), len(result_words), elapsed,
+                                                      'ok' if identical else 'MISMATCH')
+    PlexUtil.reconstruct_word = default_engine
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+import os
+import shutil
+import tempfile
+import numpy as np
+from PlexFile import PlexFile, PL_FileHeader, PL_ChanHeader, PL_DataBlockHeader, PL_SingleWFType
+from PlexFeatures import ExtractFeatures, LoadFeatures
+
+def write_plx(filename, spikes):
+    """ Write a minimal .plx file of (tick, channel, unit, waveform) spikes. """
+    header = PL_FileHeader()
+    header.MagicNumber = 0x58454c50
+    header.Version = 106
+    header.ADFrequency = 40000
+    header.NumDSPChannels = 2
+    header.NumPointsWave = 32
+    header.BitsPerSpikeSample = 12
+    header.SpikeMaxMagnitudeMV = 3000
+    header.SpikePreAmpGain = 1000
+    for _tick, channel, unit, _waveform in spikes:
+        header.TSCounts[channel][unit] += 1
+        header.WFCounts[channel][unit] += 1
+    with open(filename, 'wb') as fp:
+        fp.write(bytearray(header))
+        for channel in (1, 2):
+            chan_header = PL_ChanHeader()
+            chan_header.Channel = channel
+            chan_header.Gain = 1
+            fp.write(bytearray(chan_header))
+        for tick, channel, unit, waveform in spikes:
+            block = PL_DataBlockHeader()
+            block.Type = PL_SingleWFType
+            block.TimeStamp = tick
+            block.Channel = channel
+            block.Unit = unit
+            block.NumberOfWaveforms = 1
+            block.NumberOfWordsInWaveform = len(waveform)
+            fp.write(bytearray(block))
+            fp.write(waveform.astype(np.int16).tobytes())
+
+if __name__ == "__main__":
+    # channel 1 mixes 32 and 16 point waveforms, the shorter ones are skipped
+    rng = np.random.RandomState(0)
+    spikes = []
+    for tick in xrange(300):
+        channel = 1 + tick % 2
+        points = 16 if channel == 1 and tick % 10 == 2 else 32
+        spikes.append((tick * 100, channel, tick % 3, rng.randint(-2048, 2048, points)))
+    dirname = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(dirname, 'mixed.plx')
+        write_plx(filename, spikes)
+        ExtractFeatures(filename, processes=2)
+        features, pca = LoadFeatures(filename + '.features', 1)
+        long_ticks = [tick for tick, channel, _unit, waveform in spikes if channel == 1 and len(waveform) == 32]
+        assert np.array_equal(features['tick'], long_ticks)
+        assert pca['mean'].shape == (32,)
+        features, pca = LoadFeatures(filename + '.features', 2)
+        assert len(features) == 150
+        print "ExtractFeatures skips the spikes of other waveform lengths of a channel"
+    finally:
+        shutil.rmtree(dirname)
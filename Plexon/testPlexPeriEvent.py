@@ -0,0 +1,31 @@
+#!/usr/bin/python
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+from PlexPeriEvent import LoadSessionEvents
+
+if __name__ == "__main__":
+    records = [{'event': 'trial_start', 'time': 1.0}, {'event': 'response', 'time': 1.5},
+               {'event': 'trial_start', 'time': 3.0}, {'trial': 1}]
+    dirname = tempfile.mkdtemp()
+    try:
+        # session files of the task, JSON Lines with an interrupted last line
+        filename = os.path.join(dirname, 'session.jsonl')
+        with open(filename, 'w') as fp:
+            fp.write(''.join(json.dumps(record) + '\n' for record in records))
+            fp.write('{"event": "resp')
+        events = LoadSessionEvents(filename)
+        assert sorted(events) == ['response', 'trial_start']
+        assert np.array_equal(events['trial_start'], [1.0, 3.0])
+        assert np.array_equal(events['response'], [1.5])
+        # older session files, a single JSON list
+        filename = os.path.join(dirname, 'session.json')
+        with open(filename, 'w') as fp:
+            json.dump(records, fp)
+        events = LoadSessionEvents(filename)
+        assert np.array_equal(events['trial_start'], [1.0, 3.0])
+        print "LoadSessionEvents reads .jsonl and .json session files"
+    finally:
+        shutil.rmtree(dirname)
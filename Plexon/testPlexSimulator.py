@@ -0,0 +1,30 @@
+#!/usr/bin/python
+import time
+import threading
+import numpy as np
+import Plexon
+from PlexSimulator import PlexSimulator
+
+MARKS = 1000
+CHANNEL = 9
+
+if __name__ == "__main__":
+    # marks sent from a worker thread, as the task's EventMarker does, while the
+    # acquisition thread polls the server must each come back exactly once
+    with PlexSimulator(spike_channels=4, units=2, spike_rate=1000.0, event_bits=0, strobe_rate=0) as pc:
+        pc.StartAcquisition(interval=0.001)
+        def mark():
+            for _ in xrange(MARKS):
+                pc.MarkEvent(CHANNEL)
+                time.sleep(0)
+        marker = threading.Thread(target=mark)
+        marker.start()
+        marker.join()
+        time.sleep(0.1)
+        pc.StopAcquisition()
+        data = pc.GetAcquiredArrays(ticks=True)
+        echoed = (data['type'] == Plexon.PL_ExtEventType) & (data['channel'] == CHANNEL)
+        assert echoed.sum() == MARKS, "%d marks came back as %d events" % (MARKS, echoed.sum())
+        assert np.all(np.diff(data['timestamp']) >= 0)
+        assert pc.GetAcquisitionStats()['dropped_events'] == 0
+        print "%d marks echoed once each during acquisition" % MARKS
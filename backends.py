@@ -0,0 +1,147 @@
+"""
+Registry of acquisition backends, selected by the "acquisition" entry of
+parameters.json. Every backend offers the PlexClient interface used by the
+task: InitClient, MarkEvent, GetTimeStampArrays and CloseClient. Backend
+modules are only imported when the backend is chosen.
+"""
+
+import sys
+import time
+import subprocess
+import numpy as np
+
+
+class NullBackend:
+    # no recording device: marks go nowhere and no data comes back
+
+    def InitClient(self):
+        pass
+
+    def CloseClient(self):
+        pass
+
+    def MarkEvent(self, channel):
+        pass
+
+    def GetTimeStampArrays(self, *args, **kwargs):
+        return {'type': np.empty(0, dtype=np.uint16),
+                'channel': np.empty(0, dtype=np.uint16),
+                'unit': np.empty(0, dtype=np.uint16),
+                'timestamp': np.empty(0)}
+
+
+class NIDAQBackend(NullBackend):
+    # marks events as 8-bit words on NI-DAQ digital output lines
+
+    def __init__(self, lines='Dev1/port0/line0:7'):
+        import PyDAQmx
+        self.daqmx = PyDAQmx
+        self.lines = lines
+        self.task = None
+
+    def InitClient(self):
+        self.task = self.daqmx.Task()
+        self.task.CreateDOChan(self.lines, '', self.daqmx.DAQmx_Val_ChanForAllLines)
+        self.task.StartTask()
+
+    def CloseClient(self):
+        if self.task:
+            self.task.StopTask()
+            self.task.ClearTask()
+            self.task = None
+
+    def MarkEvent(self, channel):
+        # pulse the word of the channel, then clear the lines
+        for word in (channel, 0):
+            data = np.array([word], dtype=np.uint8)
+            self.task.WriteDigitalU8(1, 1, 10.0, self.daqmx.DAQmx_Val_GroupByChannel,
+                                     data, None, None)
+
+
+def make_plexon(pars):
+    from Plexon import PlexClient
+    client = PlexClient.PlexClient()
+    if not client.library:
+        print 'Plexon client library is not available, events are not marked.'
+        return NullBackend()
+    return client
+
+
+def make_nidaq(pars):
+    return NIDAQBackend(pars.get('nidaq_lines', 'Dev1/port0/line0:7'))
+
+
+def make_simulated(pars):
+    from Plexon import PlexSimulator
+    return PlexSimulator.PlexSimulator(**pars.get('simulator', {}))
+
+
+def make_null(pars):
+    return NullBackend()
+
+
+# name: (factory, module imported by the factory)
+BACKENDS = {'plexon': (make_plexon, 'Plexon.PlexClient'),
+            'nidaq': (make_nidaq, 'PyDAQmx'),
+            'simulated': (make_simulated, 'Plexon.PlexSimulator'),
+            'null': (make_null, None)}
+
+# seconds spent creating each backend loaded in this process
+load_times = {}
+
+
+def get_backend(name, pars=None):
+    if name not in BACKENDS:
+        raise ValueError('Unknown acquisition backend %s, choose one of %s.'
+                         % (name, ', '.join(sorted(BACKENDS))))
+    factory = BACKENDS[name][0]
+    start = time.time()
+    backend = factory(pars or {})
+    load_times[name] = time.time() - start
+    return backend
+
+
+def setup_backend(pars):
+    name = pars.get('acquisition', 'plexon')
+    try:
+        backend = get_backend(name, pars)
+    except ImportError as error:
+        print 'Cannot load %s backend (%s), events are not marked.' % (name, error)
+        backend = NullBackend()
+    print 'acquisition backend %s loaded in %.3f s' % (name, load_times.get(name, 0.0))
+    return backend
+
+
+def measure_import_time(module):
+    # import in a fresh interpreter so that nothing is cached
+    code = ('import time; start = time.time(); import %s; '
+            'print time.time() - start' % module)
+    process = subprocess.Popen([sys.executable, '-c', code],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, _err = process.communicate()
+    if process.returncode:
+        return None
+    return float(out.split()[-1])
+
+
+def import_report(selected=None):
+    lines = []
+    for name in sorted(BACKENDS):
+        module = BACKENDS[name][1]
+        cost = measure_import_time(module) if module else 0.0
+        if cost is None:
+            status = 'not installed'
+        elif name == selected:
+            status = 'loaded'
+        else:
+            status = 'saved'
+        lines.append('%-10s %-22s %s %s' % (name, module or '-',
+                                            '   -   ' if cost is None else '%.3f s' % cost,
+                                            status))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # import cost of every backend, and what the selected one saves on the others
+    selected = sys.argv[1] if len(sys.argv) > 1 else None
+    print import_report(selected)
@@ -0,0 +1,249 @@
+"""
+Append-only JSON Lines log of task events, one event dict per line.
+"""
+
+import os
+import json
+import time
+import threading
+from Queue import Queue, Full, Empty
+
+
+class EventLog:
+
+    def __init__(self, fname, flush='trial', fsync=False):
+        # flush: 'event' flushes after every event, 'trial' after every
+        # append call and 'close' only when the log is closed.
+        # fsync: also ask the OS to write flushed data to disk.
+        if flush not in ('event', 'trial', 'close'):
+            raise ValueError('Unknown flush policy %s.' % flush)
+        self.fname = fname
+        self.flush_policy = flush
+        self.fsync = fsync
+        if os.path.exists(fname):
+            recover_log(fname)
+        self.fp = open(fname, 'a')
+
+    def flush(self):
+        self.fp.flush()
+        if self.fsync:
+            os.fsync(self.fp.fileno())
+
+    def append(self, events):
+        # serialize first, so that a bad event leaves nothing half written
+        lines = [json.dumps(event) + '\n' for event in events]
+        for line in lines:
+            self.fp.write(line)
+            if self.flush_policy == 'event':
+                self.flush()
+        if self.flush_policy == 'trial':
+            self.flush()
+
+    def close(self):
+        if not self.fp.closed:
+            self.flush()
+            self.fp.close()
+
+
+class LogWriter:
+
+    # writes an EventLog and other session files on a background thread; the
+    # caller only queues work and never waits on the disk
+
+    def __init__(self, log, maxsize=1000, batch=100):
+        self.log = log
+        self.queue = Queue(maxsize)
+        self.batch = batch
+        # event lists that found the queue full, queued again on the next put
+        self.pending = []
+        self.overflows = 0
+        self.max_depth = 0
+        self.batches = 0
+        self.events = 0
+        self.write_time = 0.0
+        self.max_write_time = 0.0
+        # seconds from handing an item to the writer to having it written
+        self.written = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        # the first failed write, re-raised by close; later items are still
+        # drained so that the queue never fills up behind a dead writer
+        self.error = None
+        self.errors = 0
+        self.worker = threading.Thread(target=self.run, name='LogWriter')
+        self.worker.daemon = True
+        self.worker.start()
+
+    def put_nowait(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except Full:
+            return False
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def append(self, events):
+        if events:
+            self.pending.append(('events', time.time(), list(events)))
+        while self.pending and self.put_nowait(self.pending[0]):
+            self.pending.pop(0)
+        if self.pending:
+            self.overflows += 1
+
+    def write_json(self, fname, obj):
+        # dump obj to its own file, in order with the queued events
+        self.pending.append(('json', time.time(), fname, obj))
+        self.append([])
+
+    def written_items(self, items):
+        now = time.time()
+        for item in items:
+            self.written += 1
+            self.latency += now - item[1]
+            self.max_latency = max(self.max_latency, now - item[1])
+
+    def record_error(self, error):
+        self.errors += 1
+        if self.error is None:
+            self.error = error
+
+    def write_events(self, batched):
+        events = [event for item in batched for event in item[2]]
+        try:
+            self.log.append(events)
+        except (TypeError, ValueError) as error:
+            if len(batched) == 1:
+                self.record_error(error)
+                return
+            # nothing of the joined lists was written, retry them one by one
+            # so that only the list holding the bad event is lost
+            for item in batched:
+                self.write_events([item])
+            return
+        except Exception as error:
+            self.record_error(error)
+            return
+        self.events += len(events)
+        self.written_items(batched)
+
+    def dump_json(self, item):
+        try:
+            content = json.dumps(item[3])
+            with open(item[2], 'w+') as fp:
+                fp.write(content)
+        except Exception as error:
+            self.record_error(error)
+            return
+        self.written_items([item])
+
+    def write(self, items):
+        # in queue order, consecutive event lists joined into one append; a
+        # failed item is recorded and the rest of the batch still written
+        start = time.time()
+        batched = []
+        for item in items + [None]:
+            if item is not None and item[0] == 'events':
+                batched.append(item)
+                continue
+            if batched:
+                self.write_events(batched)
+                batched = []
+            if item is not None:
+                self.dump_json(item)
+        elapsed = time.time() - start
+        self.batches += 1
+        self.write_time += elapsed
+        self.max_write_time = max(self.max_write_time, elapsed)
+
+    def run(self):
+        done = False
+        while not done:
+            items = [self.queue.get()]
+            # batch whatever else is already waiting
+            while len(items) < self.batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            if items[-1] is None:
+                items.pop()
+                done = True
+            try:
+                self.write(items)
+            except Exception as error:
+                self.record_error(error)
+
+    def metrics(self):
+        return {'depth': self.queue.qsize(),
+                'max_depth': self.max_depth,
+                'pending': len(self.pending),
+                'overflows': self.overflows,
+                'batches': self.batches,
+                'events': self.events,
+                'mean_write_time': self.write_time / max(self.batches, 1),
+                'max_write_time': self.max_write_time,
+                'mean_latency': self.latency / max(self.written, 1),
+                'max_latency': self.max_latency,
+                'errors': self.errors,
+                'error': str(self.error) if self.error else None}
+
+    def put(self, item):
+        # wait for room in the queue, but not for a worker that has stopped
+        while self.worker.is_alive():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def close(self):
+        # block until everything queued is written, then close the log
+        for item in self.pending + [None]:
+            if not self.put(item):
+                break
+        self.pending = []
+        self.worker.join()
+        self.log.close()
+        if self.error is not None:
+            raise self.error
+
+
+def recover_log(fname):
+    # cut a final line left incomplete by a crash, so appends start on a
+    # fresh line; returns the number of bytes removed
+    with open(fname, 'rb+') as fp:
+        content = fp.read()
+        end = content.rfind('\n') + 1
+        if end == len(content):
+            return 0
+        try:
+            json.loads(content[end:])
+        except ValueError:
+            # reposition before writing after a read on the same handle
+            fp.seek(end)
+            fp.truncate()
+            return len(content) - end
+        fp.seek(len(content))
+        fp.write('\n')  # a complete event only missing its newline
+    return 0
+
+
+def load_events(fname):
+    # the same list of event dicts as the json.dump of Task.data; a
+    # truncated final line is skipped, older .json files are read as is
+    with open(fname) as fp:
+        if fname.endswith('.json'):
+            return json.load(fp)
+        lines = fp.read().split('\n')
+    events = []
+    for number, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            if number == len(lines) - 1:
+                break  # incomplete last line of an interrupted session
+            raise
+    return events
@@ -6,6 +6,7 @@ from psychopy.hardware import joystick
 import numpy as np
 import os
 from sys import platform
+from marker import EventMarker
 
 
 def setup_pars(fname):
@@ -29,25 +30,20 @@ def setup_joystick():
         return None
 
 
-def setup_logging(data, plexon):
-    if plexon:
-        plexon.InitClient()
-
-    nidaq = None
+def setup_logging(data, backend):
+    backend.InitClient()
+    marker = EventMarker(backend)
 
     def logger(event_name, channel=1):
-        if plexon:
-            plexon.MarkEvent(channel)
-        elif nidaq:
-            pass  # send user events for channel 1
-        else:
-            pass
-
         event = {"event": event_name, "time": monotonicClock.getTime()}
 
+        # the device is marked on the marker's worker thread
+        marker.mark(event_name, channel, event["time"])
+
         data.append(event)
         return event
 
+    logger.marker = marker
     return logger
 
 
@@ -100,14 +96,15 @@ def setup_data_file(taskname, subjectname):
     # check previous data files to get next name in sequence for this run
     prev_files = os.listdir(datadir)
     file_pieces = [pf.split('.') for pf in prev_files]
-    file_versions = [int(pc[1]) for pc in file_pieces if pc[-1] == 'json']
+    file_versions = [int(pc[1]) for pc in file_pieces
+                     if pc[-1] in ('json', 'jsonl')]
     if file_versions:
         this_version = max(file_versions) + 1
     else:
         this_version = 1
 
     # build file name
-    fname = '.'.join([subjectname, str(this_version), taskname, 'json'])
+    fname = '.'.join([subjectname, str(this_version), taskname, 'jsonl'])
     parsname = '.'.join([subjectname, str(this_version), 'pars', 'json'])
 
     # return absolute path
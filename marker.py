@@ -0,0 +1,45 @@
+"""
+Asynchronous delivery of event marks to the recording device.
+"""
+
+import threading
+from Queue import Queue
+from psychopy.core import monotonicClock
+
+
+class EventMarker:
+
+    def __init__(self, backend):
+        # an acquisition backend of backends.py
+        self.backend = backend
+        self.queue = Queue()
+        # delivery records, kept apart from the task data so the worker never
+        # touches dicts the main thread may be serializing
+        self.audit = []
+        self.worker = threading.Thread(target=self.deliver, name='EventMarker')
+        self.worker.daemon = True
+        self.worker.start()
+
+    def mark(self, event_name, channel, time):
+        # only a queue push on the caller's thread
+        self.queue.put((event_name, channel, time))
+
+    def deliver(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            event_name, channel, time = item
+            record = {"event": event_name, "channel": channel, "time": time}
+            try:
+                self.backend.MarkEvent(channel)
+            except Exception as error:
+                record["error"] = str(error)
+            record["delivered"] = monotonicClock.getTime()
+            record["latency"] = record["delivered"] - time
+            self.audit.append(record)
+
+    def close(self):
+        # deliver the queued marks before returning
+        self.queue.put(None)
+        self.worker.join()
@@ -8,12 +8,9 @@ import initializers
 import controller
 import display
 import psychopy.event as event
-import json
-
-try:
-    from Plexon import PlexClient
-except:
-    PlexClient = None
+import os
+import backends
+import eventlog
 
 
 class Task:
@@ -40,30 +37,43 @@ class Task:
         self.display = display.Display(self.pars)
         self.data = []
 
-        if PlexClient:
-            self.plexon = PlexClient.PlexClient()
-        else:
-            self.plexon = None
+        self.backend = backends.setup_backend(self.pars)
 
-        self.logger = initializers.setup_logging(self.data, self.plexon)
+        self.logger = initializers.setup_logging(self.data, self.backend)
         self.outfile, self.parsfile = initializers.setup_data_file(
             self.taskname, self.subject)
+        self.auditfile = os.path.splitext(self.outfile)[0] + '.marks.json'
+        # events are appended to the data file as JSON Lines, on the
+        # writer thread so that the trial loop never waits on the disk
+        self.writer = eventlog.LogWriter(eventlog.EventLog(
+            self.outfile, flush=self.pars.get('log_flush', 'trial'),
+            fsync=self.pars.get('log_fsync', False)),
+            maxsize=self.pars.get('writer_queue', 1000))
+        self.saved_events = 0
         self.joystick = initializers.setup_joystick()
         self.controller = controller.Controller(self.pars, self.display,
                                                 self.logger, self.joystick)
 
         # save task parameters
-        with open(self.parsfile, 'w+') as fp:
-            json.dump(self.pars, fp)
+        self.writer.write_json(self.parsfile, self.pars)
 
     def teardown(self):
-        if self.plexon:
-            self.plexon.CloseClient()
+        # deliver pending event marks before closing the backend
+        self.logger.marker.close()
+        self.writer.write_json(self.auditfile, self.logger.marker.audit)
+        self.backend.CloseClient()
+        self.save()
+        # write everything still queued before exiting
+        self.writer.close()
+        print 'writer: %(batches)d batches, max queue depth %(max_depth)d, ' \
+              'max write %(max_write_time).4f s, max latency %(max_latency).4f s' \
+              % self.writer.metrics()
         self.display.close()
 
     def save(self):
-        with open(self.outfile, 'w+') as fp:
-            json.dump(self.data, fp)
+        # write only the events logged since the last save
+        self.writer.append(self.data[self.saved_events:])
+        self.saved_events = len(self.data)
 
     def run(self):
         while not self.controller.end_task:
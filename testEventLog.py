@@ -0,0 +1,30 @@
+#!/usr/bin/python
+import os
+import shutil
+import tempfile
+import eventlog
+
+if __name__ == "__main__":
+    dirname = tempfile.mkdtemp()
+    try:
+        # items queued after a failed one are still written
+        fname = os.path.join(dirname, 'session.jsonl')
+        writer = eventlog.LogWriter(eventlog.EventLog(fname))
+        writer.append([{'event': 'a', 'time': 0.0}])
+        writer.write_json(os.path.join(dirname, 'missing', 'pars.json'), {})
+        writer.append([{'event': 'b', 'time': object()}])
+        writer.append([{'event': 'c', 'time': 1.0}])
+        writer.write_json(os.path.join(dirname, 'pars.json'), {'numtrials': 1})
+        try:
+            writer.close()
+        except IOError:
+            pass
+        else:
+            raise AssertionError("close did not raise the first write error")
+        events = eventlog.load_events(fname)
+        assert [event['event'] for event in events] == ['a', 'c'], events
+        assert os.path.exists(os.path.join(dirname, 'pars.json'))
+        assert writer.metrics()['errors'] == 2
+        print "LogWriter writes the items queued after a failed one"
+    finally:
+        shutil.rmtree(dirname)